@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Benchmarks for the Unlikely implementation.
+
+Generates programs along the axes given (each of which may be a comma-
+separated list of values, in which case every combination is generated),
+and times scanning, parsing, typechecking and running each separately.
+Results can be appended to a file of JSON lines, and compared with those
+of an earlier run, for the programs generated with the same axes.
+"""
+
+import json
+import platform
+import sys
+import time
+from itertools import product
+from optparse import OptionParser
+
+from unlikely.ast import ClassBase
+from unlikely.checker import Checker
+from unlikely.interpreter import Interpreter, clock
+from unlikely.parser import ClassBaseParser
+from unlikely.scanner import Scanner, TokenScanner, scan_tokens
+from unlikely.stdlib import stdlib
+from unlikely.synth import Synthesizer
+
+
+AXES = ["classes", "depth", "dependants", "assignments", "literals",
+        "comments"]
+
+
+class Sink(object):
+    """Output which is thrown away."""
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def best_of(repeat, function, *args):
+    """Calls function with the given arguments repeat times, and returns
+    the shortest time it took, and what it returned the last time.
+
+    """
+    best = None
+    for index in range(repeat):
+        start = clock()
+        result = function(*args)
+        elapsed = clock() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+
+def scan(source):
+    scanner = Scanner(source)
+    count = 0
+    while scanner.toktype != "eof":
+        scanner.scan()
+        count += 1
+    return count
+
+
+def parse(tokens):
+    classbase = ClassBase(stdlib)
+    ClassBaseParser(TokenScanner(tokens), classbase, typecheck=False).parse()
+    return classbase
+
+
+def typecheck(classbase):
+    Checker(classbase).check()
+
+
+def measure(axes, options):
+    """Generates a program with the given axes, and returns a result: the
+    axes, the size of the program, the time taken by each phase, and the
+    rate at which it ran.
+
+    """
+    source = Synthesizer(seed=options.seed, **axes).generate()
+    source = source.encode("utf-8")
+    (scan_time, count) = best_of(options.repeat, scan, source)
+    tokens = scan_tokens(source)
+    (parse_time, classbase) = best_of(options.repeat, parse, tokens)
+    (typecheck_time, result) = best_of(options.repeat, typecheck, classbase)
+    rate = 0.0
+    for index in range(options.repeat):
+        interpreter = Interpreter(stdout=Sink(), jit=options.jit)
+        interpreter.load(classbase)
+        interpreter.run(classbase.lookup_class_defn("Main"),
+                        max_steps=options.max_steps)
+        rate = max(rate, interpreter.rate())
+    return {
+        "axes": axes,
+        "bytes": len(source),
+        "tokens": count,
+        "classes": len(classbase.class_names),
+        "scan": scan_time,
+        "parse": parse_time,
+        "typecheck": typecheck_time,
+        "run": rate,
+    }
+
+
+def axes_key(axes):
+    return json.dumps(axes, sort_keys=True)
+
+
+def load_results(filename, label=None):
+    """Returns a map from the axes of the results in the named file (those
+    with the given label, or with the last label in the file, if none is
+    given) to the results.
+
+    """
+    results = []
+    f = open(filename, "r")
+    try:
+        for line in f:
+            if line.strip():
+                results.append(json.loads(line))
+    finally:
+        f.close()
+    if label is None and results:
+        label = results[-1]["label"]
+    return dict([(axes_key(result["axes"]), result) for result in results
+                 if result["label"] == label])
+
+
+def speedup(result, baseline, phase):
+    """Returns how many times faster the given phase was in the result
+    than in the baseline.
+
+    """
+    if phase == "run":
+        (new, old) = (baseline[phase], result[phase])
+    else:
+        (new, old) = (result[phase], baseline[phase])
+    if new == 0.0:
+        return float("inf")
+    return old / new
+
+
+def describe(result, baseline):
+    line = " ".join(["%s=%s" % (axis, result["axes"][axis])
+                     for axis in AXES])
+    line += "  %d tokens" % result["tokens"]
+    for phase in ["scan", "parse", "typecheck"]:
+        line += "  %s %.4fs" % (phase, result[phase])
+        if baseline is not None:
+            line += " (%.2fx)" % speedup(result, baseline, phase)
+    line += "  run %.0f/s" % result["run"]
+    if baseline is not None:
+        line += " (%.2fx)" % speedup(result, baseline, "run")
+    return line
+
+
+def parse_values(text, type_):
+    return [type_(value) for value in text.split(",")]
+
+
+def main(argv):
+    usage = "[python] benchmark.py {options}"
+    optparser = OptionParser(usage + "\n" + __doc__)
+    defaults = Synthesizer()
+    for axis in AXES:
+        optparser.add_option("--" + axis, metavar="N[,N...]",
+                             dest=axis, default=str(getattr(defaults, axis)),
+                             help="%s of the generated programs "
+                                  "(default: %%default)" % axis)
+    optparser.add_option("--seed", metavar="N", type="int",
+                         dest="seed", default=0,
+                         help="seed of the generator (default: 0)")
+    optparser.add_option("-r", "--repeat", metavar="N", type="int",
+                         dest="repeat", default=3,
+                         help="time each phase N times, and keep the best "
+                              "(default: 3)")
+    optparser.add_option("-n", "--max-steps", metavar="N", type="int",
+                         dest="max_steps", default=100000,
+                         help="run each program for N continuations "
+                              "(default: 100000)")
+    optparser.add_option("-j", "--jit",
+                         action="store_true", dest="jit", default=False,
+                         help="run the programs with the JIT")
+    optparser.add_option("-e", "--emit",
+                         action="store_true", dest="emit", default=False,
+                         help="write out the first generated program, "
+                              "instead of benchmarking")
+    optparser.add_option("-o", "--output", metavar="FILE",
+                         dest="output", default=None,
+                         help="append the results to FILE, as JSON lines")
+    optparser.add_option("-l", "--label", metavar="LABEL",
+                         dest="label", default=None,
+                         help="label the results with LABEL (default: the "
+                              "date and time)")
+    optparser.add_option("-b", "--baseline", metavar="FILE",
+                         dest="baseline", default=None,
+                         help="compare with the results in FILE, labelled "
+                              "--baseline-label (default: the last label "
+                              "in it)")
+    optparser.add_option("--baseline-label", metavar="LABEL",
+                         dest="baseline_label", default=None)
+    (options, args) = optparser.parse_args(argv[1:])
+    try:
+        values = [parse_values(getattr(options, axis),
+                               float if axis == "comments" else int)
+                  for axis in AXES]
+        combinations = [dict(zip(AXES, combination))
+                        for combination in product(*values)]
+        for axes in combinations:
+            Synthesizer(**axes)
+    except ValueError as e:
+        optparser.error(str(e))
+    if options.emit:
+        sys.stdout.write(Synthesizer(seed=options.seed,
+                                     **combinations[0]).generate())
+        return
+    baselines = {}
+    if options.baseline is not None:
+        baselines = load_results(options.baseline, options.baseline_label)
+    label = options.label
+    if label is None:
+        label = time.strftime("%Y-%m-%d %H:%M:%S")
+    output = None
+    if options.output is not None:
+        output = open(options.output, "a")
+    try:
+        for axes in combinations:
+            result = measure(axes, options)
+            result["label"] = label
+            result["python"] = platform.python_version()
+            result["max_steps"] = options.max_steps
+            result["jit"] = options.jit
+            sys.stdout.write(describe(result,
+                                      baselines.get(axes_key(axes))) + "\n")
+            sys.stdout.flush()
+            if output is not None:
+                output.write(json.dumps(result, sort_keys=True) + "\n")
+                output.flush()
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -8,23 +8,447 @@
 The Coldwater static analyzer for the Unlikely programming language.
 """
 
+import atexit
+import json
+import mmap
+import os
+import signal
 import sys
+import time
+from multiprocessing import Pool
 from optparse import OptionParser
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
+from unlikely.ast import ClassBase
+from unlikely.bytecode import (assemble, load_bytecode, save_bytecode,
+                               BytecodeError)
+from unlikely.cache import cache_key, load_cache, save_cache
+from unlikely.checker import Checker
+from unlikely.depgraph import DependencyGraph
 from unlikely.scanner import Scanner
 from unlikely.parser import ClassBaseParser
-from unlikely.stdlib import stdlib
+from unlikely.profiler import Profile
+from unlikely.scheduler import Scheduler, SLICE
+from unlikely.checkpoint import CheckpointLog, CheckpointError
+from unlikely.interpreter import (Interpreter, BUFFER_SIZE, clock,
+                                  freeze_heap)
+from unlikely.stdlib import stdlib, program
 
 
-def load(filename, options):
-    f = open(filename, "rb")
-    scanner = Scanner(f.read())
-    f.close()
-    parser = ClassBaseParser(scanner, stdlib)
+def open_source(f):
+    """Return a memory map of the given open file, or the file itself if it
+    cannot be mapped (it is empty, or not a regular file.)
+
+    """
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        return f
+
+
+def find_program(classbase):
+    """Return the first concrete Program class defined in the given
+    ClassBase.
+
+    """
+    for class_name in classbase.class_names:
+        class_defn = classbase.lookup_class_defn(class_name)
+        if (class_defn.is_subclass_of(program) and
+            not class_defn.has_modifier("abstract")):
+            return class_defn
+    return None
+
+
+def program_class(classbase, options):
+    """Return the Program class to run: the one named in options, or the
+    first concrete one defined in the given ClassBase (None, if there is
+    none.)
+
+    """
+    if options.program is not None:
+        return classbase.lookup_class_defn(options.program)
+    return find_program(classbase)
+
+
+def make_interpreter(classbase, bytecode, options, profile=None):
+    """Return an Interpreter, as options ask for, which has loaded the
+    given ClassBase, or the given Bytecode, if it is not None.
+
+    """
+    interpreter = Interpreter(profile=profile, jit=options.jit,
+                              buffer_size=options.buffer_size,
+                              suspend_input=options.asynchronous)
+    if bytecode is not None:
+        interpreter.load_bytecode(bytecode)
+    else:
+        interpreter.load(classbase)
+    return interpreter
+
+
+def run(classbase, options, bytecode=None):
+    class_defn = program_class(classbase, options)
+    if class_defn is None:
+        return
+    profile = None
+    if options.profile:
+        profile = Profile()
+        atexit.register(profile.dump, sys.stderr)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1,
+                          lambda signum, frame: profile.dump(sys.stderr))
+    interpreter = make_interpreter(classbase, bytecode, options, profile)
+    freeze_heap()
+    if options.asynchronous:
+        result = run_asynchronously(interpreter, class_defn, options)
+    elif options.checkpoint is not None:
+        result = run_with_checkpoints(interpreter, class_defn, classbase,
+                                      options)
+    else:
+        result = interpreter.run(class_defn, max_steps=options.max_steps)
+    sys.stdout.flush()
+    if options.stats:
+        sys.stderr.write("%d continuations in %.3fs (%.0f/s)\n" %
+                         (interpreter.continuations, interpreter.elapsed,
+                          interpreter.rate()))
+    if isinstance(result, int) and not isinstance(result, bool):
+        sys.exit(result)
+
+
+def run_asynchronously(interpreter, class_defn, options):
+    """Runs the given Program class with the given Interpreter, under an
+    asyncio event loop of its own (see aio.py.)
+
+    """
+    import asyncio
+    from unlikely import aio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            aio.run(interpreter, class_defn, max_steps=options.max_steps))
+    finally:
+        loop.close()
+
+
+def parse(source, classbase, deferred=False):
+    """Parse the given source into the given ClassBase.  Returns False if
+    the source had errors which were reported (and parsing went on.)  If
+    deferred is given, the source is only typechecked once it has all been
+    parsed, in one pass (and not at all, if it had errors.)
+
+    """
+    scanner = Scanner(source)
+    parser = ClassBaseParser(scanner, classbase, typecheck=not deferred)
     parser.parse()
+    if scanner.errors > 0:
+        return False
+    if deferred:
+        Checker(classbase).check()
+    return True
+
+
+def check(filename, cache=False, deferred=False):
+    """Parse and check the named source file into a new overlay on the
+    stdlib.  Returns the overlay, and whether the source had no errors
+    which were reported (rather than raised.)
+
+    """
+    classbase = ClassBase(stdlib)
+    ok = True
+    f = open(filename, "rb")
+    source = open_source(f)
+    try:
+        if cache and source is not f:
+            # only a regular file can be hashed without consuming it
+            cache_filename = filename + "c"
+            key = cache_key(source, classbase)
+            if not load_cache(cache_filename, key, classbase):
+                ok = parse(source, classbase, deferred)
+                if ok:
+                    try:
+                        save_cache(cache_filename, key, classbase)
+                    except EnvironmentError:
+                        pass
+        else:
+            ok = parse(source, classbase, deferred)
+    finally:
+        if source is not f:
+            source.close()
+        f.close()
+    return (classbase, ok)
+
+
+def run_with_checkpoints(interpreter, class_defn, classbase, options):
+    """Runs the given Program class with the given Interpreter, writing a
+    checkpoint of it to the file named in options every so many
+    continuations (see checkpoint.py.)  If that file already holds one,
+    the program is resumed from it, rather than started afresh.  Once the
+    program stops, the file is removed.
+
+    """
+    log = CheckpointLog(options.checkpoint, classbase)
+    try:
+        if not log.restore(interpreter):
+            interpreter.start(class_defn)
+        elif options.stats:
+            sys.stderr.write("resumed after %d continuations\n" %
+                             log.continuations)
+        while True:
+            limit = options.checkpoint_every
+            if options.max_steps is not None:
+                limit = min(limit,
+                            options.max_steps - interpreter.continuations)
+                if limit <= 0:
+                    return None
+            result = interpreter.resume(limit)
+            if interpreter.suspended is None:
+                break
+            # what it printed up to the checkpoint is not printed again
+            interpreter.stdout.flush()
+            log.write(interpreter)
+    finally:
+        interpreter.stdout.flush()
+        log.close()
+    os.remove(options.checkpoint)
+    return result
+
+
+def schedule(filenames, options):
+    """Run the programs in the named files together, interleaved by one
+    Scheduler (see scheduler.py), each with an Interpreter of its own, and
+    report on those which failed (or, with --stats, on every one.)  Return
+    the number which failed: which raised an error, or exceeded a quota.
+
+    """
+    scheduler = Scheduler(options.slice_steps)
+    failures = 0
+    for filename in filenames:
+        (classbase, bytecode, ok) = prepare(filename, options)
+        if not ok:
+            sys.stderr.write("%s: not run, as it has errors\n" % filename)
+            failures += 1
+            continue
+        class_defn = program_class(classbase, options)
+        if class_defn is None:
+            continue
+        scheduler.spawn(make_interpreter(classbase, bytecode, options),
+                        class_defn, max_steps=options.max_steps,
+                        max_instances=options.max_instances, name=filename)
+    freeze_heap()
+    start = clock()
+    tasks = scheduler.run()
+    elapsed = clock() - start
+    for task in tasks:
+        if task.error is not None:
+            failures += 1
+        if task.error is not None or options.stats:
+            sys.stderr.write(str(task) + "\n")
+    if options.stats:
+        continuations = sum([task.steps for task in tasks])
+        sys.stderr.write("%d programs, %d continuations in %.3fs (%.0f/s)\n"
+                         % (len(tasks), continuations, elapsed,
+                            continuations / max(elapsed, 1e-9)))
+    return failures
+
+
+def prepare(filename, options):
+    """Check the named source file, or load the named bytecode file, as
+    options ask, and dump its AST if they ask for that.  Return its
+    ClassBase, its Bytecode (None, if it was not assembled), and whether
+    it had no errors which were reported.
+
+    """
+    bytecode = None
+    ok = True
+    if filename.endswith(".unlikelyb"):
+        classbase = ClassBase(stdlib)
+        try:
+            bytecode = load_bytecode(filename, classbase)
+        except BytecodeError as e:
+            # it is stale, or damaged; it must be assembled again
+            sys.stderr.write("error: %s\n" % e)
+            ok = False
+    else:
+        (classbase, ok) = check(filename, options.cache, options.deferred)
+        if options.bytecode and ok:
+            bytecode = assemble(classbase)
+            save_bytecode(os.path.splitext(filename)[0] + ".unlikelyb",
+                          bytecode, classbase)
     if options.dump_ast:
         print("---AST---")
-        print(str(stdlib))
+        print(str(classbase))
+    return (classbase, bytecode, ok)
+
+
+def load(filename, options):
+    """Check (or load) the named file, and run it if options ask for that
+    and it had no errors.  Return whether it had none.
+
+    """
+    (classbase, bytecode, ok) = prepare(filename, options)
+    if options.run and ok:
+        run(classbase, options, bytecode)
+    return ok
+
+
+def check_quietly(check, *args):
+    """Calls check with the given arguments; it should return a ClassBase
+    and whether it had no errors, as check() does.  Returns the error (None
+    if there were none), and the time taken.  Whatever the checker prints
+    while checking is taken as the error.
+
+    """
+    start = clock()
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    messages = []
+    try:
+        try:
+            (classbase, ok) = check(*args)
+        except Exception as e:
+            ok = False
+            messages.append(e.__class__.__name__ + ": " + str(e))
+        messages[:0] = sys.stdout.getvalue().splitlines()
+    finally:
+        sys.stdout = stdout
+    error = None
+    if not ok:
+        error = "; ".join(messages)
+    return (error, clock() - start)
+
+
+def check_job(job):
+    """Checks one source file, for --jobs.  Returns the filename, the
+    error (None if the file passed), and the time taken.
+
+    """
+    (filename, cache, deferred) = job
+    (error, elapsed) = check_quietly(check, filename, cache, deferred)
+    return (filename, error, elapsed)
+
+
+def report(filename, error, elapsed, options, **fields):
+    """Writes a line saying whether the named file passed, in the format
+    given by options.  Any other fields are added to a JSON line.
+
+    """
+    if options.format == "json":
+        fields.update({"file": filename, "ok": error is None,
+                       "error": error, "seconds": elapsed})
+        line = json.dumps(fields, sort_keys=True)
+    elif error is None:
+        line = "ok    %.3fs  %s" % (elapsed, filename)
+    else:
+        line = "FAIL  %.3fs  %s: %s" % (elapsed, filename, error)
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def check_all(filenames, options):
+    """Checks the named source files using a pool of options.jobs worker
+    processes, and reports on each, in the order they were named.  Returns
+    the number of files which failed.
+
+    """
+    start = clock()
+    jobs = [(filename, options.cache, options.deferred)
+            for filename in filenames]
+    pool = None
+    if options.jobs > 1:
+        pool = Pool(options.jobs)
+        results = pool.imap(check_job, jobs)
+    else:
+        results = map(check_job, jobs)
+    failures = 0
+    for (filename, error, elapsed) in results:
+        if error is not None:
+            failures += 1
+        report(filename, error, elapsed, options)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if options.format != "json":
+        sys.stdout.write("%d files, %d failed, in %.3fs\n" %
+                         (len(jobs), failures, clock() - start))
+    return failures
+
+
+def recheck(graph, filename):
+    """Checks the named source file again, into its DependencyGraph."""
+    f = open(filename, "rb")
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    return graph.check(source)
+
+
+def report_recheck(filename, graph, error, elapsed, options):
+    """Reports on a check of the named source file into its
+    DependencyGraph, saying how many of its classes were checked.
+
+    """
+    if graph.classbase is None:
+        classes = len(graph.checked)
+    else:
+        classes = len(graph.classbase.class_names)
+    if options.format == "json":
+        report(filename, error, elapsed, options,
+               checked=len(graph.checked), classes=classes)
+    else:
+        report(filename + " (%d of %d classes checked)" %
+               (len(graph.checked), classes),
+               error, elapsed, options)
+
+
+def replay(filenames, options):
+    """Checks the named source files as successive versions of one source:
+    the first in full, and each of the others only where it differs from
+    the one before, as --watch would, reporting on each.  Dumps the AST of
+    the last, if options ask for that.  Returns the number which failed.
+
+    """
+    graph = DependencyGraph(stdlib)
+    failures = 0
+    for filename in filenames:
+        (error, elapsed) = check_quietly(recheck, graph, filename)
+        report_recheck(filename, graph, error, elapsed, options)
+        if error is not None:
+            failures += 1
+    if options.dump_ast and graph.classbase is not None:
+        print("---AST---")
+        print(str(graph.classbase))
+    return failures
+
+
+def watch(filenames, options):
+    """Checks the named source files, and then checks each of them again
+    whenever it changes, until interrupted.  The classes of each file are
+    kept between checks, and only those affected by a change are checked
+    again.
+
+    """
+    graphs = dict([(filename, DependencyGraph(stdlib))
+                   for filename in filenames])
+    mtimes = {}
+    try:
+        while True:
+            for filename in filenames:
+                try:
+                    mtime = os.stat(filename).st_mtime
+                except EnvironmentError:
+                    mtime = None
+                if filename in mtimes and mtimes[filename] == mtime:
+                    continue
+                mtimes[filename] = mtime
+                graph = graphs[filename]
+                (error, elapsed) = check_quietly(recheck, graph, filename)
+                report_recheck(filename, graph, error, elapsed, options)
+            time.sleep(options.interval)
+    except KeyboardInterrupt:
+        pass
 
 
 def main(argv):
@@ -33,9 +457,169 @@ def main(argv):
     optparser.add_option("-a", "--dump-ast",
                          action="store_true", dest="dump_ast", default=False,
                          help="dump AST after source is parsed")
+    optparser.add_option("-c", "--cache",
+                         action="store_true", dest="cache", default=False,
+                         help="keep the checked classes in a cache file "
+                              "beside the source, and load them from it "
+                              "while the source is unchanged")
+    optparser.add_option("-b", "--bytecode",
+                         action="store_true", dest="bytecode",
+                         default=False,
+                         help="assemble the checked program into bytecode, "
+                              "write it beside the source (foo.unlikely "
+                              "into foo.unlikelyb), and run that; a "
+                              ".unlikelyb file given is loaded and run "
+                              "without being checked again")
+    optparser.add_option("-d", "--deferred",
+                         action="store_true", dest="deferred",
+                         default=False,
+                         help="typecheck the whole source in one pass, "
+                              "after it has all been parsed")
+    optparser.add_option("-r", "--run",
+                         action="store_true", dest="run", default=False,
+                         help="run the program after it has been checked")
+    optparser.add_option("-p", "--program", metavar="CLASS",
+                         dest="program", default=None,
+                         help="Program subclass to run (default: the first "
+                              "concrete one defined in the source)")
+    optparser.add_option("-n", "--max-steps", metavar="N", type="int",
+                         dest="max_steps", default=None,
+                         help="stop running after N continuations (with "
+                              "--schedule, fail each program which runs "
+                              "more than N)")
+    optparser.add_option("-s", "--stats",
+                         action="store_true", dest="stats", default=False,
+                         help="report continuations per second after running")
+    optparser.add_option("-P", "--profile",
+                         action="store_true", dest="profile", default=False,
+                         help="count the continuations of each method and "
+                              "the constructions of each class, time the "
+                              "built-in ones, and report them after "
+                              "running (or on SIGUSR1)")
+    optparser.add_option("-B", "--buffer-size", metavar="N", type="int",
+                         dest="buffer_size", default=BUFFER_SIZE,
+                         help="write out what the program prints once N "
+                              "characters of it have been collected, or "
+                              "when it stops or reads input; 0 writes it "
+                              "out at once (default: %default)")
+    optparser.add_option("-A", "--async",
+                         action="store_true", dest="asynchronous",
+                         default=False,
+                         help="run the program under asyncio, suspending "
+                              "it while it waits for input (Python 3.5 "
+                              "or later)")
+    optparser.add_option("-S", "--schedule",
+                         action="store_true", dest="schedule",
+                         default=False,
+                         help="run the programs in all the files given "
+                              "together, taking turns, and report on "
+                              "those which fail")
+    optparser.add_option("-l", "--slice", metavar="N", type="int",
+                         dest="slice_steps", default=SLICE,
+                         help="how many continuations --schedule runs "
+                              "each program for at a time "
+                              "(default: %default)")
+    optparser.add_option("-m", "--max-instances", metavar="N", type="int",
+                         dest="max_instances", default=None,
+                         help="with --schedule, fail each program which "
+                              "keeps more than N objects alive")
+    optparser.add_option("-k", "--checkpoint", metavar="FILE",
+                         dest="checkpoint", default=None,
+                         help="write a checkpoint of the running program "
+                              "to FILE every so often, and resume it from "
+                              "the last one there, if there is one; FILE "
+                              "is removed once the program stops")
+    optparser.add_option("-e", "--checkpoint-every", metavar="N",
+                         type="int", dest="checkpoint_every",
+                         default=100000,
+                         help="how many continuations to run between "
+                              "checkpoints (default: %default)")
+    optparser.add_option("-J", "--jit",
+                         action="store_true", dest="jit", default=False,
+                         help="compile the cycles of continuations the "
+                              "program runs most often into Python code")
+    optparser.add_option("-j", "--jobs", metavar="N", type="int",
+                         dest="jobs", default=None,
+                         help="check the files with N worker processes, "
+                              "and report whether each passed")
+    optparser.add_option("-f", "--format", metavar="FORMAT", type="choice",
+                         choices=["text", "json"], dest="format",
+                         default="text",
+                         help="how --jobs and --watch report: text (the "
+                              "default), or json (one object per line)")
+    optparser.add_option("-w", "--watch",
+                         action="store_true", dest="watch", default=False,
+                         help="check the files again whenever they change, "
+                              "checking only the classes affected")
+    optparser.add_option("-i", "--interval", metavar="SECONDS",
+                         type="float", dest="interval", default=0.5,
+                         help="how often --watch looks for changes "
+                              "(default: 0.5)")
+    optparser.add_option("-R", "--replay",
+                         action="store_true", dest="replay", default=False,
+                         help="check the files as successive versions of "
+                              "one source, as --watch would if it were "
+                              "edited from each to the next")
     (options, args) = optparser.parse_args(argv[1:])
+    if options.asynchronous and sys.version_info < (3, 5):
+        optparser.error("--async needs Python 3.5 or later")
+    if options.buffer_size < 0:
+        optparser.error("--buffer-size cannot be negative")
+    if options.checkpoint is not None:
+        if options.asynchronous or options.schedule or len(args) != 1:
+            optparser.error("--checkpoint runs one program; it cannot "
+                            "--async or --schedule")
+        if options.checkpoint_every < 1:
+            optparser.error("--checkpoint-every must be at least 1")
+    if options.jit and options.profile:
+        optparser.error("--profile cannot count what --jit compiles")
+    if options.watch:
+        if (options.jobs is not None or options.cache or
+            options.deferred or options.run or options.dump_ast or
+            options.bytecode or options.schedule):
+            optparser.error("--watch keeps the checked classes in memory; "
+                            "it cannot --jobs, --cache, --deferred, --run, "
+                            "--dump-ast, --bytecode or --schedule")
+        watch(args, options)
+        return
+    if options.replay:
+        if (options.jobs is not None or options.cache or
+            options.deferred or options.run or options.bytecode or
+            options.schedule):
+            optparser.error("--replay checks as --watch does; it cannot "
+                            "--jobs, --cache, --deferred, --run, "
+                            "--bytecode or --schedule")
+        if replay(args, options) > 0:
+            sys.exit(1)
+        return
+    if options.schedule:
+        if (options.jobs is not None or options.profile or
+            options.asynchronous):
+            optparser.error("--schedule runs the programs in one process; "
+                            "it cannot --jobs, --profile or --async")
+        if options.slice_steps < 1:
+            optparser.error("--slice must be at least 1")
+        if schedule(args, options) > 0:
+            sys.exit(1)
+        return
+    if options.jobs is not None:
+        if options.jobs < 1:
+            optparser.error("--jobs must be at least 1")
+        if options.run or options.dump_ast or options.bytecode:
+            optparser.error("--jobs only checks; it cannot --run, "
+                            "--dump-ast or --bytecode")
+        if check_all(args, options) > 0:
+            sys.exit(1)
+        return
+    failures = 0
     for filename in args:
-        load(filename, options)
+        try:
+            if not load(filename, options):
+                failures += 1
+        except CheckpointError as e:
+            optparser.error(str(e))
+    if options.run and failures > 0:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
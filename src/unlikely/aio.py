@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Running Unlikely programs under asyncio.  (This module needs Python 3.5 or
+later, unlike the rest of the implementation.)
+
+The program is run by an Interpreter which suspends it whenever it
+continues an Input which has no line of input to read (see
+interpreter.py); run() then awaits a line from a StreamReader, gives it to
+the interpreter, and resumes the program where it stopped.  So that other
+tasks get to run too, the program is also run for only so many
+continuations at a time, yielding to the event loop in between.
+"""
+
+import asyncio
+import sys
+
+
+# How many continuations a program is run for before it yields.
+SLICE = 10000
+
+
+async def stdin_reader():
+    """Returns a StreamReader reading from sys.stdin.  (A regular file,
+    which the event loop cannot watch, is read all at once instead.)
+
+    """
+    loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except (ValueError, OSError):
+        reader.feed_data(sys.stdin.buffer.read())
+        reader.feed_eof()
+    return reader
+
+
+async def run(interpreter, class_defn, reader=None, accumulator=None,
+              max_steps=None, slice_steps=SLICE):
+    """Runs the given Program class, as Interpreter.run does, with the
+    given Interpreter, which must have been created with suspend_input.
+    Input is read from the given StreamReader (by default, one reading
+    sys.stdin) only when the program is waiting for it.
+
+    """
+    if not interpreter.suspend_input:
+        raise ValueError("the interpreter must suspend the program for "
+                         "input")
+    start = interpreter.continuations
+    interpreter.start(class_defn, accumulator)
+    try:
+        while True:
+            limit = slice_steps
+            if max_steps is not None:
+                limit = min(limit,
+                            max_steps - (interpreter.continuations - start))
+                if limit <= 0:
+                    return None
+            result = interpreter.resume(limit)
+            if interpreter.waiting:
+                if reader is None:
+                    reader = await stdin_reader()
+                line = await reader.readline()
+                interpreter.lines.append(line.decode("utf-8"))
+            elif interpreter.suspended is None:
+                return result
+            else:
+                await asyncio.sleep(0)
+    finally:
+        interpreter.stdout.flush()
@@ -6,8 +6,18 @@
 """
 Abstract Syntax Trees for the Unlikely programming language.
 $Id: ast.py 318 2010-01-07 01:49:38Z cpressey $
+
+So that large class bases stay small in memory, every node keeps its
+attributes in __slots__, the names of classes and their members are
+interned (each distinct name is kept only once), and modifiers are kept
+as bit flags.  A method definition is sealed once it has been parsed,
+and a class definition when it is frozen: their lists of names and nodes
+become tuples.
 """
 
+import sys
+import weakref
+
 
 class ArtefactExistsError(Exception):
     """An exception indicating that a proposed artefact (class, method,
@@ -46,22 +56,92 @@ class ClassRelationshipError(Exception):
     pass
 
 
-class AST:
+# The bit flags of the modifiers of classes and methods.
+FINAL = 1
+SATURATED = 2
+ABSTRACT = 4
+FORCIBLE = 8
+
+CLASS_MODIFIERS = {"final": FINAL, "saturated": SATURATED,
+                   "abstract": ABSTRACT, "forcible": FORCIBLE}
+METHOD_MODIFIERS = {"abstract": ABSTRACT}
+
+try:
+    intern_string = sys.intern
+except AttributeError:
+    intern_string = intern
+
+
+def intern_name(name):
+    """Returns the one copy of the given name which all nodes share.  It is
+    interned by Python, so it is freed once no node refers to it.  (Python
+    2 interns only byte strings, so there a name which is all ASCII is
+    interned as one, and any other name is not interned.)
+
+    """
+    if not isinstance(name, str):
+        try:
+            name = name.encode("ascii")
+        except UnicodeError:
+            return name
+    return intern_string(name)
+
+
+class AST(object):
     """Class representing nodes in an abstract syntax tree."""
-    pass
+    __slots__ = ()
 
 
 class ClassBase(AST):
-    """A collection of Unlikely class definitions."""
-    def __init__(self):
+    """A collection of Unlikely class definitions.
+
+    A ClassBase may be an overlay on a parent ClassBase, usually the frozen
+    stdlib: the classes of the parent can be looked up in it, but classes
+    added to it are only added to it, so any number of overlays can share
+    one parent.
+
+    """
+    __slots__ = ('parent', 'frozen', 'class_defn_map', 'class_names',
+                 'value_class_defns')
+
+    def __init__(self, parent=None):
+        assert parent is None or parent.frozen
+        self.parent = parent
+        self.frozen = False
         self.class_defn_map = {}
+        self.class_names = []
+        self.value_class_defns = weakref.WeakValueDictionary()
 
     def __str__(self):
         s = ""
-        for class_name in self.class_defn_map:
-            s = s + str(self.class_defn_map[class_name]) + " "
+        for class_name in self.get_all_class_names():
+            s = s + str(self.lookup_class_defn(class_name)) + " "
         return "ClassBase { " + s + "}"
 
+    def get_all_class_names(self):
+        """Returns the names of the classes in this ClassBase and its
+        parents, in the order they were defined.
+
+        """
+        chain = []
+        classbase = self
+        while classbase is not None:
+            chain.append(classbase)
+            classbase = classbase.parent
+        class_names = []
+        for classbase in reversed(chain):
+            class_names.extend(classbase.class_names)
+        return class_names
+
+    def freeze(self):
+        """Makes this ClassBase, and every class in it, read-only, so that
+        it can be shared by overlays, even ones in different threads.
+
+        """
+        for class_name in self.class_names:
+            self.class_defn_map[class_name].freeze()
+        self.frozen = True
+
     def add_class_defn_by_name(self, class_name, superclass_name=None,
                                modifiers=None):
         """A factory method.  Call this instead of ClassDefn().
@@ -69,11 +149,17 @@ class ClassBase(AST):
         The third and fourth arguments are conveniences for stdlib.
 
         """
-        if class_name in self.class_defn_map:
-            class_defn = self.class_defn_map[class_name]
-        else:
-            class_defn = ClassDefn(self, class_name)
+        if is_value_class_name(class_name):
+            self.lookup_value_class_defn(class_name).cannot_redefine()
+        class_defn = self.find_class_defn(class_name)
+        if class_defn is None:
+            if self.frozen:
+                raise ClassRelationshipError("cannot add class " +
+                                             class_name +
+                                             " to a frozen class base")
+            class_defn = ClassDefn(self, intern_name(class_name))
             self.class_defn_map[class_name] = class_defn
+            self.class_names.append(class_name)
         if modifiers is not None:
             for modifier in modifiers:
                 class_defn.add_modifier(modifier)
@@ -81,11 +167,44 @@ class ClassBase(AST):
             class_defn.set_superclass_by_name(superclass_name)
         return class_defn
 
+    def find_class_defn(self, class_name):
+        """Returns the named class from this ClassBase or its parents, or
+        None if there is no such class.
+
+        """
+        classbase = self
+        while classbase is not None:
+            if class_name in classbase.class_defn_map:
+                return classbase.class_defn_map[class_name]
+            classbase = classbase.parent
+        return None
+
     def lookup_class_defn(self, class_name):
-        if class_name in self.class_defn_map:
-            return self.class_defn_map[class_name]
+        class_defn = self.find_class_defn(class_name)
+        if class_defn is not None:
+            return class_defn
+        if is_value_class_name(class_name):
+            return self.lookup_value_class_defn(class_name)
         raise ArtefactNotFoundError("class " + class_name)
 
+    def lookup_value_class_defn(self, class_name):
+        """Returns the class for an integer or string constant, creating it
+        if need be.  These classes are not kept in class_defn_map; each is
+        shared for as long as something refers to it, and then forgotten.
+        (A frozen ClassBase doesn't remember them at all.)
+
+        """
+        class_defn = self.value_class_defns.get(class_name)
+        if class_defn is None:
+            class_defn = ValueClassDefn(self, class_name)
+            if not self.frozen:
+                self.value_class_defns[class_name] = class_defn
+        return class_defn
+
+
+def is_value_class_name(class_name):
+    return class_name[0].isdigit() or class_name[0] == "\""
+
 
 class ClassDefn(AST):
     """
@@ -93,6 +212,16 @@ class ClassDefn(AST):
     Really, only ClassBase should be allowed to call this constructor.
     Everyone else should use the factory methods on ClassBase.
     """
+    __slots__ = ('classbase', 'name', 'superclass', 'dependant_map',
+                 'dependant_names', 'prop_defn_map', 'prop_names',
+                 'method_defn_map', 'modifiers', 'subclass_defns', 'defined',
+                 'frozen', '_class_defn_cache', '_prop_table',
+                 '_method_table', '_slot_layout')
+
+    # what is left out when a class is pickled
+    CACHES = ('_class_defn_cache', '_prop_table', '_method_table',
+              '_slot_layout')
+
     def __init__(self, classbase, class_name):
         assert isinstance(classbase, ClassBase)
         self.classbase = classbase
@@ -101,8 +230,33 @@ class ClassDefn(AST):
         self.dependant_map = {}
         self.dependant_names = []
         self.prop_defn_map = {}
+        self.prop_names = []
         self.method_defn_map = {}
-        self.modifiers = []
+        self.modifiers = 0
+        self.subclass_defns = []
+        self.defined = False
+        self.frozen = False
+        self._class_defn_cache = {}
+        self._prop_table = None
+        self._method_table = None
+        self._slot_layout = None
+
+    def __getstate__(self):
+        """The caches and tables of a class are not pickled; they are
+        rebuilt when next needed.
+
+        """
+        return dict([(name, getattr(self, name))
+                     for name in ClassDefn.__slots__
+                     if name not in ClassDefn.CACHES])
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+        self._class_defn_cache = {}
+        self._prop_table = None
+        self._method_table = None
+        self._slot_layout = None
 
     def __str__(self):
         c = "class " + self.name + "("
@@ -124,35 +278,73 @@ class ClassDefn(AST):
             c = c + str(method_defn) + " "
         return c + "}"
 
+    def freeze(self):
+        """
+        Makes this class read-only.  Its tables and slot layout are built,
+        and its dependants resolved, beforehand, so that nothing is ever
+        written to a frozen class; classes which extend it aren't
+        registered as its subclasses, either, since it will never change
+        in a way that would need them to be invalidated.  It, and its
+        methods, are sealed.
+        """
+        if self._method_table is None:
+            self.build_tables()
+        self.get_slot_layout()
+        for dependant_name in self.dependant_names:
+            self.lookup_class_defn(dependant_name)
+        self.dependant_names = tuple(self.dependant_names)
+        self.prop_names = tuple(self.prop_names)
+        self.subclass_defns = tuple(self.subclass_defns)
+        for method_defn in self.method_defn_map.values():
+            method_defn.seal()
+        self.frozen = True
+
+    def check_not_frozen(self):
+        if self.frozen:
+            raise ClassRelationshipError("cannot redefine frozen class " +
+                                         self.name)
+
     def set_superclass_by_name(self, superclass_name):
         """
         Sets the superclass of this class.
         """
+        self.check_not_frozen()
         superclass = self.classbase.lookup_class_defn(superclass_name)
         if not self.has_modifier("forcible"):
             if superclass.has_modifier("final"):
                 raise ClassRelationshipError("cannot inherit from final " +
                                              superclass_name)
+        if superclass is self or (len(self.subclass_defns) > 0 and
+                                  superclass.is_subclass_of(self)):
+            raise ClassRelationshipError("class " + self.name +
+                                         " cannot inherit from itself")
         if (self.superclass is not None and
             self.superclass.name != superclass_name):
             raise ClassRelationshipError("class " + self.name +
                                          " already has superclass " +
                                          self.superclass.name)
-        self.superclass = superclass
+        if self.superclass is None:
+            self.superclass = superclass
+            if not superclass.frozen:
+                superclass.subclass_defns.append(self)
+            self.invalidate()
         if len(self.dependant_names) == 0:
             for dependant_name in superclass.dependant_names:
                 self.dependant_names.append(dependant_name)
                 self.dependant_map[dependant_name] = \
                   superclass.dependant_map[dependant_name]
+        self.invalidate_scope()
         return superclass
 
     def add_dependant_by_name(self, dependant_name):
+        self.check_not_frozen()
         if dependant_name in self.dependant_map:
             raise ClassRelationshipError("dependant " + dependant_name +
                                          " already declared")
         dependant = self.classbase.lookup_class_defn(dependant_name)
         self.dependant_map[dependant.name] = dependant
         self.dependant_names.append(dependant.name)
+        self.invalidate_scope()
 
     def get_dependant_by_index(self, index):
         return self.dependant_map[self.dependant_names[index]]
@@ -161,11 +353,18 @@ class ClassDefn(AST):
         """
         Factory method.  Call this instead of PropDefn().
         """
+        self.check_not_frozen()
         try:
             prop_defn = self.lookup_prop_defn(prop_name)
         except ArtefactNotFoundError:
+            prop_name = intern_name(prop_name)
             prop_defn = PropDefn(self, prop_name)
             self.prop_defn_map[prop_name] = prop_defn
+            self.prop_names.append(prop_name)
+            if self._prop_table is not None:
+                self._prop_table[prop_name] = prop_defn
+            self._slot_layout = None
+            self.invalidate_subclasses()
             prop_defn.type_class_defn = self.lookup_class_defn(type_class_name)
             return prop_defn
         raise ArtefactExistsError("property " + prop_defn.name)
@@ -174,6 +373,7 @@ class ClassDefn(AST):
         """
         Factory method.  Call this instead of MethodDefn().
         """
+        self.check_not_frozen()
         if method_name in self.method_defn_map:
             raise ArtefactExistsError("method " + method_name)
         try:
@@ -185,22 +385,80 @@ class ClassDefn(AST):
             raise ClassRelationshipError("new method " + method_name +
                                          " not allowed on saturated " +
                                          self.name)
-        method_defn = MethodDefn(self, method_name)
+        method_defn = MethodDefn(self, intern_name(method_name))
         self.method_defn_map[method_defn.name] = method_defn
+        if self._method_table is not None:
+            self._method_table[method_name] = method_defn
+        self.invalidate_subclasses()
         return method_defn
 
+    def invalidate(self):
+        """
+        Discards the flattened method and property tables and the slot
+        layout of this class and of all its subclasses, after this class
+        has gained a member or a superclass.
+        """
+        pending = [self]
+        while pending:
+            class_defn = pending.pop()
+            class_defn._prop_table = None
+            class_defn._method_table = None
+            class_defn._slot_layout = None
+            pending.extend(class_defn.subclass_defns)
+
+    def invalidate_subclasses(self):
+        for subclass_defn in self.subclass_defns:
+            subclass_defn.invalidate()
+
+    def invalidate_scope(self):
+        """
+        Discards the resolved class names cached by this class and all its
+        subclasses, after the dependants or the superclass of this class
+        have changed.
+        """
+        pending = [self]
+        while pending:
+            class_defn = pending.pop()
+            if len(class_defn._class_defn_cache) > 0:
+                class_defn._class_defn_cache = {}
+            pending.extend(class_defn.subclass_defns)
+
+    def build_tables(self):
+        """
+        Builds the flattened tables of all methods and properties defined
+        on and inherited by this class, from those of its superclass.
+        The superclass chain is walked iteratively, so that this works
+        however deep the hierarchy is.
+        """
+        chain = []
+        class_defn = self
+        while class_defn is not None and class_defn._method_table is None:
+            chain.append(class_defn)
+            class_defn = class_defn.superclass
+        for class_defn in reversed(chain):
+            superclass = class_defn.superclass
+            if superclass is None:
+                prop_table = {}
+                method_table = {}
+            else:
+                prop_table = dict(superclass._prop_table)
+                method_table = dict(superclass._method_table)
+            prop_table.update(class_defn.prop_defn_map)
+            method_table.update(class_defn.method_defn_map)
+            class_defn._prop_table = prop_table
+            class_defn._method_table = method_table
+
     def add_modifier(self, modifier):
-        if modifier not in ["final", "saturated", "abstract", "forcible"]:
+        if modifier not in CLASS_MODIFIERS:
             raise BadModifierError(modifier)
-        self.modifiers.append(modifier)
+        self.check_not_frozen()
+        self.modifiers |= CLASS_MODIFIERS[modifier]
 
     def has_modifier(self, modifier):
-        return modifier in self.modifiers
+        return (self.modifiers & CLASS_MODIFIERS.get(modifier, 0)) != 0
 
     def must_be_injected(self):
-        if self.has_modifier("final"):
-            return False
-        return True
+        return (self.modifiers & FINAL) == 0
 
     def lookup_class_defn(self, class_name):
         """Note that this first looks up the class definition in the dependant
@@ -210,71 +468,100 @@ class ClassDefn(AST):
         make any sense.
 
         """
-        if class_name[0].isdigit():
-            class_defn = self.classbase.add_class_defn_by_name(class_name)
-            class_defn.add_modifier("final")
-            class_defn.add_modifier("forcible")
-            class_defn.set_superclass_by_name("Integer")
-            return class_defn
-        if class_name[0] == "\"":
-            class_defn = self.classbase.add_class_defn_by_name(class_name)
-            class_defn.add_modifier("final")
-            class_defn.add_modifier("forcible")
-            class_defn.set_superclass_by_name("String")
-            return class_defn
-        if class_name in self.dependant_map:
-            return self.dependant_map[class_name]
-        if self.superclass is not None:
-            return self.superclass.lookup_class_defn(class_name)
-        class_defn = self.classbase.lookup_class_defn(class_name)
-        if class_defn is not None and not class_defn.must_be_injected():
-            return class_defn
-        raise ArtefactNotFoundError("dependant class " + class_name)
+        if is_value_class_name(class_name):
+            return self.classbase.lookup_value_class_defn(class_name)
+        if class_name in self._class_defn_cache:
+            return self._class_defn_cache[class_name]
+        scope = self
+        class_defn = None
+        while scope is not None:
+            if class_name in scope._class_defn_cache:
+                class_defn = scope._class_defn_cache[class_name]
+                break
+            if class_name in scope.dependant_map:
+                class_defn = scope.dependant_map[class_name]
+                break
+            scope = scope.superclass
+        if class_defn is None:
+            class_defn = self.classbase.lookup_class_defn(class_name)
+            if class_defn.must_be_injected():
+                raise ArtefactNotFoundError("dependant class " + class_name)
+        if not self.frozen:
+            self._class_defn_cache[class_name] = class_defn
+        return class_defn
 
     def lookup_prop_defn(self, prop_name):
-        if prop_name in self.prop_defn_map:
-            return self.prop_defn_map[prop_name]
-        if self.superclass is not None:
-            return self.superclass.lookup_prop_defn(prop_name)
+        if self._prop_table is None:
+            self.build_tables()
+        if prop_name in self._prop_table:
+            return self._prop_table[prop_name]
         raise ArtefactNotFoundError("property " + prop_name)
 
     def lookup_method_defn(self, method_name):
-        if method_name in self.method_defn_map:
-            return self.method_defn_map[method_name]
-        if self.superclass is not None:
-            return self.superclass.lookup_method_defn(method_name)
+        if self._method_table is None:
+            self.build_tables()
+        if method_name in self._method_table:
+            return self._method_table[method_name]
         raise ArtefactNotFoundError("method " + method_name)
 
+    def get_slot_layout(self):
+        """
+        Returns the properties of an instance of this class, in the order
+        in which an instance stores them.  Inherited properties come
+        first, so each property is stored at the same index in instances
+        of every subclass of the class that defines it.
+        """
+        if self._slot_layout is None:
+            chain = []
+            class_defn = self
+            while (class_defn is not None and
+                   class_defn._slot_layout is None):
+                chain.append(class_defn)
+                class_defn = class_defn.superclass
+            for class_defn in reversed(chain):
+                if class_defn.superclass is None:
+                    layout = []
+                else:
+                    layout = list(class_defn.superclass._slot_layout)
+                for prop_name in class_defn.prop_names:
+                    layout.append(class_defn.prop_defn_map[prop_name])
+                class_defn._slot_layout = tuple(layout)
+        return self._slot_layout
+
     def is_subclass_of(self, class_defn):
-        if self == class_defn:
-            return True
-        if self.superclass is None:
-            return False
-        return self.superclass.is_subclass_of(class_defn)
+        superclass = self
+        while superclass is not None:
+            if superclass == class_defn:
+                return True
+            superclass = superclass.superclass
+        return False
 
     def is_saturated(self):
-        if self.has_modifier("saturated"):
-            return True
-        if self.superclass is None:
-            return False
-        return self.superclass.is_saturated()
+        superclass = self
+        while superclass is not None:
+            if superclass.modifiers & SATURATED:
+                return True
+            superclass = superclass.superclass
+        return False
 
     def find_all_method_defns(self, map=None):
         """
         Returns all methods defined and inherited by this class, in the form
         of a map from method name to method definition object.
         """
+        if self._method_table is None:
+            self.build_tables()
         if map is None:
-            map = {}
-        for method_defn_name in self.method_defn_map:
+            return dict(self._method_table)
+        for method_defn_name in self._method_table:
             if method_defn_name not in map:
-                map[method_defn_name] = self.method_defn_map[method_defn_name]
-        if self.superclass is not None:
-            self.superclass.find_all_method_defns(map)
+                map[method_defn_name] = self._method_table[method_defn_name]
         return map
 
     def typecheck(self):
-        map = self.find_all_method_defns()
+        if self._method_table is None:
+            self.build_tables()
+        map = self._method_table
         if not self.has_modifier("abstract"):
             for method_defn_name in map:
                 if map[method_defn_name].has_modifier("abstract"):
@@ -292,10 +579,77 @@ class ClassDefn(AST):
                                              " has no abstract methods")
 
 
+class ValueClassDefn(ClassDefn):
+    """
+    One of the countably infinite final subclasses of Integer or String,
+    each representing a single constant value.  These have no members of
+    their own, so instead of keeping tables they defer everything to
+    their superclass, and they are not registered as its subclasses.
+    Only ClassBase.lookup_value_class_defn should call this constructor.
+    """
+    __slots__ = ('value', '__weakref__')
+
+    modifiers = FINAL | FORCIBLE
+    frozen = True
+    prop_defn_map = {}
+    prop_names = ()
+    method_defn_map = {}
+    subclass_defns = ()
+
+    def __init__(self, classbase, class_name):
+        assert isinstance(classbase, ClassBase)
+        self.classbase = classbase
+        self.name = class_name
+        if class_name[0] == "\"":
+            self.value = class_name[1:-1]
+            self.superclass = classbase.lookup_class_defn("String")
+        else:
+            self.value = int(class_name)
+            self.superclass = classbase.lookup_class_defn("Integer")
+        self.dependant_map = self.superclass.dependant_map
+        self.dependant_names = self.superclass.dependant_names
+
+    def cannot_redefine(self):
+        raise ClassRelationshipError("cannot redefine constant class " +
+                                     self.name)
+
+    def set_superclass_by_name(self, superclass_name):
+        self.cannot_redefine()
+
+    def add_dependant_by_name(self, dependant_name):
+        self.cannot_redefine()
+
+    def add_prop_defn_by_name(self, prop_name, type_class_name):
+        self.cannot_redefine()
+
+    def add_method_defn_by_name(self, method_name):
+        self.cannot_redefine()
+
+    def add_modifier(self, modifier):
+        self.cannot_redefine()
+
+    def lookup_class_defn(self, class_name):
+        return self.superclass.lookup_class_defn(class_name)
+
+    def lookup_prop_defn(self, prop_name):
+        return self.superclass.lookup_prop_defn(prop_name)
+
+    def lookup_method_defn(self, method_name):
+        return self.superclass.lookup_method_defn(method_name)
+
+    def find_all_method_defns(self, map=None):
+        return self.superclass.find_all_method_defns(map)
+
+    def get_slot_layout(self):
+        return self.superclass.get_slot_layout()
+
+
 class PropDefn(AST):
     """
     Definition of a property on an Unlikely class.
     """
+    __slots__ = ('class_defn', 'name', 'type_class_defn')
+
     def __init__(self, class_defn, name):
         assert isinstance(class_defn, ClassDefn)
         self.class_defn = class_defn
@@ -308,11 +662,20 @@ class PropDefn(AST):
     def lookup_class_defn(self, class_name):
         return self.class_defn.lookup_class_defn(class_name)
 
+    def get_slot_index(self):
+        """
+        Returns the index at which instances store this property.
+        """
+        return self.class_defn.get_slot_layout().index(self)
+
 
 class MethodDefn(AST):
     """
     Definition of a method on an Unlikely class.
     """
+    __slots__ = ('class_defn', 'name', 'param_decl_map', 'param_names',
+                 'assignments', 'modifiers', 'continue_')
+
     def __init__(self, class_defn, name):
         assert isinstance(class_defn, ClassDefn)
         self.class_defn = class_defn
@@ -320,7 +683,7 @@ class MethodDefn(AST):
         self.param_decl_map = {}
         self.param_names = []
         self.assignments = []
-        self.modifiers = []
+        self.modifiers = 0
         self.continue_ = None
 
     def __str__(self):
@@ -348,6 +711,7 @@ class MethodDefn(AST):
                                         type_class_name +
                                         " but property is a " +
                                         prop_defn.type_class_defn.name)
+        param_name = intern_name(param_name)
         param_decl = ParamDecl(self, param_name, type_class_defn)
         self.param_decl_map[param_name] = param_decl
         self.param_names.append(param_name)
@@ -362,12 +726,12 @@ class MethodDefn(AST):
         return assignment
 
     def add_modifier(self, modifier):
-        if modifier not in ["abstract"]:
+        if modifier not in METHOD_MODIFIERS:
             raise BadModifierError(modifier)
-        self.modifiers.append(modifier)
+        self.modifiers |= METHOD_MODIFIERS[modifier]
 
     def has_modifier(self, modifier):
-        return modifier in self.modifiers
+        return (self.modifiers & METHOD_MODIFIERS.get(modifier, 0)) != 0
 
     def add_continue(self):
         """
@@ -378,6 +742,18 @@ class MethodDefn(AST):
         self.continue_ = continue_
         return continue_
 
+    def seal(self):
+        """
+        Makes the lists of this method, and of its statements, into
+        tuples, once it has all been parsed.
+        """
+        self.param_names = tuple(self.param_names)
+        self.assignments = tuple(self.assignments)
+        for assignment in self.assignments:
+            assignment.seal()
+        if self.continue_ is not None:
+            self.continue_.seal()
+
     def lookup_class_defn(self, class_name):
         return self.class_defn.lookup_class_defn(class_name)
 
@@ -394,6 +770,8 @@ class ParamDecl(AST):
     """
     Definition of a formal parameter to an Unlikely method.
     """
+    __slots__ = ('method_defn', 'name', 'type_class_defn')
+
     def __init__(self, method_defn, name, type_class_defn):
         assert isinstance(method_defn, MethodDefn)
         self.method_defn = method_defn
@@ -408,6 +786,8 @@ class Assignment(AST):
     """
     An Unlikely assignment statement.
     """
+    __slots__ = ('method_defn', 'lhs', 'rhs')
+
     def __init__(self, method_defn):
         assert isinstance(method_defn, MethodDefn)
         self.method_defn = method_defn
@@ -429,16 +809,26 @@ class Assignment(AST):
         self.rhs = construction
         return construction
 
+    def seal(self):
+        if self.lhs is not None:
+            self.lhs.seal()
+        if self.rhs is not None:
+            self.rhs.seal()
+
 
 class Continue(AST):
     """
     An Unlikely continue ("goto") statement.
     """
+    __slots__ = ('method_defn', 'prop_defn', 'method_name',
+                 'target_method_defn', 'param_exprs')
+
     def __init__(self, method_defn):
         assert isinstance(method_defn, MethodDefn)
         self.method_defn = method_defn
         self.prop_defn = None
         self.method_name = None
+        self.target_method_defn = None
         self.param_exprs = []
 
     def set_prop_defn_by_name(self, prop_name):
@@ -447,8 +837,10 @@ class Continue(AST):
 
     def set_method_defn_by_name(self, method_name):
         type_class_defn = self.prop_defn.type_class_defn
-        self.method_defn = type_class_defn.lookup_method_defn(method_name)
-        assert isinstance(self.method_defn, MethodDefn)
+        target_method_defn = type_class_defn.lookup_method_defn(method_name)
+        assert isinstance(target_method_defn, MethodDefn)
+        self.target_method_defn = target_method_defn
+        self.method_name = target_method_defn.name
 
     def add_qual_name(self):
         qual_name = QualName(self)
@@ -460,15 +852,21 @@ class Continue(AST):
         self.param_exprs.append(construction)
         return construction
 
+    def seal(self):
+        self.param_exprs = tuple(self.param_exprs)
+        for param_expr in self.param_exprs:
+            param_expr.seal()
+
     def typecheck(self):
-        if len(self.param_exprs) != len(self.method_defn.param_names):
+        target_method_defn = self.target_method_defn
+        if len(self.param_exprs) != len(target_method_defn.param_names):
             message = ("continue provides " + str(len(self.param_exprs)) +
-                       " params, " + str(len(self.method_defn.param_names)) +
-                       " needed")
+                       " params, " +
+                       str(len(target_method_defn.param_names)) + " needed")
             raise IncompatibleTypeError(message)
         i = 0
         for param_expr in self.param_exprs:
-            param_decl = self.method_defn.get_param_decl_by_index(i)
+            param_decl = target_method_defn.get_param_decl_by_index(i)
             arg_type_class_defn = param_expr.get_type_class_defn()
             param_type_class_defn = param_decl.type_class_defn
             if not arg_type_class_defn.is_subclass_of(param_type_class_defn):
@@ -482,6 +880,8 @@ class Construction(AST):
     """
     An Unlikely construction ("new") expression.
     """
+    __slots__ = ('parent', 'type_class_defn', 'dependencies')
+
     def __init__(self, parent, type_class_name):
         assert isinstance(parent, Assignment) or isinstance(parent, Continue)
         self.parent = parent
@@ -497,6 +897,9 @@ class Construction(AST):
     def get_type_class_defn(self):
         return self.type_class_defn
 
+    def seal(self):
+        self.dependencies = tuple(self.dependencies)
+
     def typecheck(self):
         if len(self.dependencies) != len(self.type_class_defn.dependant_names):
             message = ("instantiation specifies " +
@@ -520,6 +923,8 @@ class QualName(AST):
     """
     An Unlikely qualified name (property reference) expression.
     """
+    __slots__ = ('parent', 'prop_defns', 'scope_class_defn')
+
     def __init__(self, parent):
         assert isinstance(parent, Assignment) or isinstance(parent, Continue)
         self.parent = parent
@@ -535,5 +940,8 @@ class QualName(AST):
     def get_type_class_defn(self):
         return self.scope_class_defn
 
+    def seal(self):
+        self.prop_defns = tuple(self.prop_defns)
+
     def get_prop_defn_by_index(self, index):
         return self.prop_defns[index]
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Bytecode for the Unlikely programming language.
+
+The Assembler lowers every method of a checked program into a flat array
+of integers: for each method, the number of registers it uses, followed
+by its instructions, each an opcode followed by its operands.  Operands
+are register numbers, slot indices, or indices into the tables of the
+Bytecode (constants, paths of slot indices, and constructions.)
+
+    LOAD_CONST  dst constant          dst = constant
+    LOAD_PATH   dst path              dst = the property at the end of path
+                                      (of containers)
+    LOAD_BOXED  dst path              dst = the property at the end of path,
+                                      boxed in place if it is passive
+    NEW         dst construction      dst = a new object
+    STORE_PATH  path index src        the object at the end of path (of
+                                      containers) .slots[index] = src
+    GOTO        index name n          continue the named method on the
+                (slot src) * n        object in slots[index], after setting
+                                      the given slots of it
+
+A VM runs these instructions, in place of the closures the compiler would
+otherwise have built (see compiler.py), and with the same semantics: the
+constructions are compiled by the Compiler, and passive values are boxed
+in the same places.
+
+A Bytecode can be saved to a file, and loaded from it, along with the
+classes of the program, so that it can be run without its source being
+scanned, parsed or checked at all.  The file starts with a header line
+giving a key (see cache.py), which covers the layout of integers in
+memory too; the classes and tables follow, pickled, and then the instructions, which are mapped into memory rather than read.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from io import BytesIO
+
+from .ast import Construction
+from .cache import (ClassBasePickler, ClassBaseUnpickler, member_ids,
+                    format_key, dump_classes, load_classes,
+                    UNPICKLING_ERRORS)
+from .compiler import (slot_indices, find_containers, find_copies,
+                       find_boxed)
+from .runtime import unassigned, container_at, value_of_class_defn
+
+
+FORMAT_VERSION = 2
+MAGIC = b"UNLIKELYB"
+
+# Opcodes.
+LOAD_CONST = 1
+LOAD_PATH = 2
+NEW = 3
+STORE_PATH = 4
+GOTO = 5
+LOAD_BOXED = 6
+
+# Type code of the array of instructions.
+CODE_TYPE = "i"
+
+
+class BytecodeError(Exception):
+    """
+    Raised when a bytecode file cannot be loaded, or when a VM meets an
+    instruction it does not know.
+    """
+    pass
+
+
+class Bytecode(object):
+    """
+    The methods of a program, assembled into one array of instructions
+    (code), and the tables their operands index.  methods lists, for each
+    method, the class which defines it, its name, and the offset of its
+    instructions in code.
+    """
+
+    def __init__(self, code, constants, paths, constructions, methods):
+        self.code = code
+        self.constants = constants
+        self.paths = paths
+        self.constructions = constructions
+        self.methods = methods
+
+    def method_defns(self):
+        """Returns the method definitions assembled, and their offsets."""
+        return [(class_defn.method_defn_map[method_name], offset)
+                for (class_defn, method_name, offset) in self.methods]
+
+
+class Assembler(object):
+    """
+    Assembles the methods of the classes of an overlay ClassBase into
+    Bytecode.
+    """
+
+    def __init__(self, classbase):
+        self.classbase = classbase
+        self.code = array(CODE_TYPE)
+        self.constants = []
+        self.paths = []
+        self.constructions = []
+        self.indices = {}
+        self.boxed = set()
+        self.registers = 0
+
+    def index_of(self, table, key, entry):
+        """Returns the index of the given entry in the given table, adding
+        it if there is none with the same key.
+
+        """
+        key = (id(table), key)
+        if key not in self.indices:
+            self.indices[key] = len(table)
+            table.append(entry)
+        return self.indices[key]
+
+    def constant(self, value):
+        return self.index_of(self.constants, (type(value), value), value)
+
+    def path(self, indices):
+        return self.index_of(self.paths, indices, indices)
+
+    def construction(self, class_defn, dependencies, boxed):
+        # each construction gets an entry of its own, since the VM's
+        # constructor for it remembers the injections it last resolved
+        self.constructions.append((class_defn, tuple(dependencies), boxed))
+        return len(self.constructions) - 1
+
+    def emit(self, *words):
+        self.code.extend(words)
+
+    def assemble(self):
+        """Returns the Bytecode of every method defined in the ClassBase."""
+        methods = []
+        for class_name in self.classbase.class_names:
+            class_defn = self.classbase.class_defn_map[class_name]
+            for method_defn in class_defn.method_defn_map.values():
+                if method_defn.continue_ is not None:
+                    methods.append((class_defn, method_defn))
+        containers = set()
+        copies = {}
+        for (class_defn, method_defn) in methods:
+            find_containers(method_defn, containers)
+            find_copies(method_defn, copies)
+        self.boxed = find_boxed(containers, copies)
+        offsets = [(class_defn, method_defn.name,
+                    self.assemble_method_defn(method_defn))
+                   for (class_defn, method_defn) in methods]
+        return Bytecode(self.code, self.constants, self.paths,
+                        self.constructions, offsets)
+
+    def assemble_method_defn(self, method_defn):
+        offset = len(self.code)
+        # the number of registers, which is filled in below
+        self.emit(0)
+        self.registers = 0
+        for assignment in method_defn.assignments:
+            lhs = assignment.lhs.prop_defns[-1]
+            register = self.assemble_expr(assignment.rhs,
+                                          lhs in self.boxed)
+            indices = slot_indices(assignment.lhs)
+            self.emit(STORE_PATH, self.path(indices[:-1]), indices[-1],
+                      register)
+        continue_ = method_defn.continue_
+        target_method_defn = continue_.target_method_defn
+        param_prop_defns = [target_method_defn.lookup_prop_defn(param_name)
+                            for param_name in target_method_defn.param_names]
+        registers = [self.assemble_expr(param_expr,
+                                        prop_defn in self.boxed)
+                     for (param_expr, prop_defn)
+                     in zip(continue_.param_exprs, param_prop_defns)]
+        words = [GOTO, continue_.prop_defn.get_slot_index(),
+                 self.constant(target_method_defn.name), len(registers)]
+        for (prop_defn, register) in zip(param_prop_defns, registers):
+            words.extend([prop_defn.get_slot_index(), register])
+        self.emit(*words)
+        self.code[offset] = self.registers
+        return offset
+
+    def assemble_expr(self, expr, boxed=False):
+        """Assembles the evaluation of the given expression into a new
+        register, and returns the register.
+
+        """
+        register = self.registers
+        self.registers += 1
+        if isinstance(expr, Construction):
+            class_defn = expr.type_class_defn
+            value = value_of_class_defn(class_defn)
+            if (value is not None and not class_defn.must_be_injected() and
+                not boxed):
+                self.emit(LOAD_CONST, register, self.constant(value))
+            else:
+                self.emit(NEW, register,
+                          self.construction(class_defn, expr.dependencies,
+                                            boxed))
+        elif expr.prop_defns[-1] in self.boxed:
+            self.emit(LOAD_BOXED, register, self.path(slot_indices(expr)))
+        else:
+            self.emit(LOAD_PATH, register, self.path(slot_indices(expr)))
+        return register
+
+
+def assemble(classbase):
+    """Returns the Bytecode of the classes of the given overlay ClassBase.
+    """
+    return Assembler(classbase).assemble()
+
+
+class VM(object):
+    """
+    Runs the methods in a Bytecode.  The constructions in it are compiled
+    by the given Compiler, as they would have been had the methods been.
+    """
+
+    def __init__(self, bytecode, compiler):
+        self.bytecode = bytecode
+        self.constructors = [compiler.compile_constructor(class_defn,
+                                                          dependencies,
+                                                          boxed)
+                             for (class_defn, dependencies, boxed)
+                             in bytecode.constructions]
+
+    def method(self, offset):
+        """Returns a closure which runs the method at the given offset, as
+        the closure the compiler would have built for it does.
+
+        """
+        code = self.bytecode.code
+        constants = self.bytecode.constants
+        paths = self.bytecode.paths
+        constructors = self.constructors
+        size = code[offset]
+        start = offset + 1
+
+        def method(instance):
+            registers = [None] * size
+            pc = start
+            while True:
+                op = code[pc]
+                if op == LOAD_PATH:
+                    path = paths[code[pc + 2]]
+                    source = instance
+                    for index in path[:-1]:
+                        source = container_at(source, index)
+                    value = source.slots[path[-1]]
+                    if value is None:
+                        raise unassigned(source, path[-1])
+                    registers[code[pc + 1]] = value
+                    pc += 3
+                elif op == LOAD_BOXED:
+                    value = instance
+                    for index in paths[code[pc + 2]]:
+                        value = container_at(value, index)
+                    registers[code[pc + 1]] = value
+                    pc += 3
+                elif op == NEW:
+                    registers[code[pc + 1]] = \
+                      constructors[code[pc + 2]](instance)
+                    pc += 3
+                elif op == STORE_PATH:
+                    target = instance
+                    for index in paths[code[pc + 1]]:
+                        target = container_at(target, index)
+                    target.slots[code[pc + 2]] = registers[code[pc + 3]]
+                    pc += 4
+                elif op == LOAD_CONST:
+                    registers[code[pc + 1]] = constants[code[pc + 2]]
+                    pc += 3
+                elif op == GOTO:
+                    target = container_at(instance, code[pc + 1])
+                    method_name = constants[code[pc + 2]]
+                    end = pc + 4 + 2 * code[pc + 3]
+                    pc += 4
+                    while pc < end:
+                        target.slots[code[pc]] = registers[code[pc + 1]]
+                        pc += 2
+                    return (target, method_name)
+                else:
+                    raise BytecodeError("unknown opcode %d at %d" %
+                                        (op, pc))
+        return method
+
+
+def bytecode_key(classbase):
+    """Returns the key of a bytecode file whose classes are to be loaded
+    into the given overlay ClassBase.
+
+    """
+    layout = "%s %d" % (sys.byteorder, array(CODE_TYPE).itemsize)
+    return format_key(FORMAT_VERSION, classbase, layout.encode("utf-8"))
+
+
+def save_bytecode(filename, bytecode, classbase):
+    """Writes the classes of the given overlay ClassBase, and the given
+    Bytecode of them, to the named file.
+
+    """
+    tables = BytesIO()
+    pickler = ClassBasePickler(tables, member_ids(classbase))
+    dump_classes(pickler, classbase)
+    pickler.dump((bytecode.constants, bytecode.paths,
+                  bytecode.constructions, bytecode.methods))
+    tables = tables.getvalue()
+    header = MAGIC + b" " + bytecode_key(classbase) + b"\n"
+    itemsize = bytecode.code.itemsize
+    # the instructions start at a multiple of their size
+    padding = -(len(header) + 16 + len(tables)) % itemsize
+    f = open(filename, "wb")
+    try:
+        f.write(header)
+        f.write(struct.pack("<QQ", len(tables), len(bytecode.code)))
+        f.write(tables)
+        f.write(b"\0" * padding)
+        if hasattr(bytecode.code, "tobytes"):
+            f.write(bytecode.code.tobytes())
+        else:
+            f.write(bytecode.code.tostring())
+    finally:
+        f.close()
+
+
+def map_code(data, start, count):
+    """Returns the array of count instructions at the given offset of the
+    given memory map, as a view of the map where memoryview can give one,
+    and otherwise as a copy.
+
+    """
+    size = count * array(CODE_TYPE).itemsize
+    if hasattr(memoryview, "cast"):
+        return memoryview(data)[start:start + size].cast(CODE_TYPE)
+    code = array(CODE_TYPE)
+    code.fromstring(data[start:start + size])
+    return code
+
+
+def load_bytecode(filename, classbase):
+    """Adds the classes in the named bytecode file to the given overlay
+    ClassBase, and returns their Bytecode.  Raises BytecodeError if the
+    file is not one which can be loaded into it.
+
+    """
+    f = open(filename, "rb")
+    try:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            raise BytecodeError(filename + " cannot be mapped")
+    finally:
+        f.close()
+    header_end = data.find(b"\n")
+    if data[:header_end] != MAGIC + b" " + bytecode_key(classbase):
+        raise BytecodeError(filename + " is not a bytecode file for this "
+                            "version of Unlikely")
+    start = header_end + 1
+    try:
+        (tables_size, count) = struct.unpack("<QQ", data[start:start + 16])
+        start += 16
+        unpickler = ClassBaseUnpickler(
+            BytesIO(data[start:start + tables_size]), classbase)
+        load_classes(unpickler, classbase)
+        (constants, paths, constructions, methods) = unpickler.load()
+    except UNPICKLING_ERRORS + (struct.error,):
+        raise BytecodeError(filename + " is damaged")
+    start += tables_size
+    start += -start % array(CODE_TYPE).itemsize
+    if start + count * array(CODE_TYPE).itemsize > len(data):
+        raise BytecodeError(filename + " is damaged")
+    return Bytecode(map_code(data, start, count), constants, paths,
+                    constructions, methods)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+On-disk cache of parsed and typechecked Unlikely class bases.
+
+Much like a .pyc file, a cache file holds the classes which a source file
+added to an overlay ClassBase, so that they can be loaded again without
+scanning, parsing or typechecking the source.  It starts with a header
+line giving a key, which is a hash of the source, the cache format, the
+major version of Python, and the classes of the parent of the overlay
+(usually, just the stdlib); the rest is a pickle.  Bytecode files and
+checkpoint logs are headed by keys made in the same way (see format_key.)  A cache file whose key
+does not match, or which cannot be unpickled, is simply ignored (and then
+rewritten.)  A cache file is written under a name of its own and then
+renamed into place, so that it is never seen half written, even by
+another process checking the same source.
+
+Classes, and the members of the classes of the parent, are pickled by
+name, so each class is pickled separately (however deep the hierarchy
+is) and loading the cache links the new classes to the live parent.
+"""
+
+import gc
+import hashlib
+import os
+import pickle
+import sys
+from io import BytesIO
+
+from .ast import ClassBase, ClassDefn, ValueClassDefn
+
+
+FORMAT_VERSION = 3
+MAGIC = b"UNLIKELYC"
+
+# How much of the source is hashed at a time.
+CHUNK_SIZE = 65536
+
+replace = getattr(os, "replace", os.rename)
+
+
+def parent_class_names(classbase):
+    if classbase.parent is None:
+        return []
+    return classbase.parent.get_all_class_names()
+
+
+def fingerprint(classbase):
+    """Returns a hash of the classes of the parent of the given ClassBase.
+    """
+    digest = hashlib.sha1()
+    for class_name in parent_class_names(classbase):
+        class_defn = classbase.lookup_class_defn(class_name)
+        digest.update(str(class_defn).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def format_key(version, classbase, *extra):
+    """Returns the key heading a file in the given version of a format,
+    whose classes are to be loaded into the given overlay ClassBase: a
+    hash of the version, the major version of Python, the classes of the
+    parent of the overlay, and whatever extra byte strings (or memory maps
+    of them, which are hashed a chunk at a time rather than copied) the
+    file also depends on.
+
+    """
+    digest = hashlib.sha1()
+    digest.update(("%d %d " % (version, sys.version_info[0]))
+                  .encode("utf-8"))
+    digest.update(fingerprint(classbase).encode("utf-8"))
+    for data in extra:
+        for start in range(0, len(data), CHUNK_SIZE):
+            digest.update(data[start:start + CHUNK_SIZE])
+    return digest.hexdigest().encode("utf-8")
+
+
+def cache_key(source, classbase):
+    """Returns the key of the cache of the given source (a byte string, or
+    a memory map of one), when it is parsed into the given overlay
+    ClassBase.
+
+    """
+    return format_key(FORMAT_VERSION, classbase, source)
+
+
+class ClassBasePickler(pickle.Pickler):
+    def __init__(self, file, members):
+        """members maps the ids of the objects to be pickled by name to
+        their persistent ids; the ids of classes are added as they are
+        pickled, so that each is pickled (and memoized) only once.
+
+        """
+        pickle.Pickler.__init__(self, file, 2)
+        self.members = members
+
+    def persistent_id(self, obj):
+        pid = self.members.get(id(obj))
+        if pid is not None:
+            return pid
+        if isinstance(obj, ValueClassDefn):
+            pid = ("value", obj.name)
+        elif isinstance(obj, ClassDefn):
+            pid = ("class", obj.name)
+        elif isinstance(obj, ClassBase):
+            pid = ("classbase",)
+        else:
+            return None
+        self.members[id(obj)] = pid
+        return pid
+
+
+# What unpickling a damaged pickle may raise.
+UNPICKLING_ERRORS = (EOFError, pickle.UnpicklingError, AttributeError,
+                     ImportError, ValueError, KeyError, IndexError,
+                     TypeError)
+
+
+class ClassBaseUnpickler(pickle.Unpickler):
+    def __init__(self, file, classbase):
+        pickle.Unpickler.__init__(self, file)
+        self.classbase = classbase
+        self.shells = {}
+
+    def persistent_load(self, pid):
+        kind = pid[0]
+        if kind == "classbase":
+            return self.classbase
+        if kind == "value":
+            return self.classbase.lookup_value_class_defn(pid[1])
+        if pid[1] in self.shells:
+            class_defn = self.shells[pid[1]]
+        else:
+            class_defn = self.classbase.lookup_class_defn(pid[1])
+        if kind == "class":
+            return class_defn
+        if kind == "prop":
+            return class_defn.prop_defn_map[pid[2]]
+        method_defn = class_defn.method_defn_map[pid[2]]
+        if kind == "method":
+            return method_defn
+        return method_defn.param_decl_map[pid[3]]
+
+
+def member_ids(classbase):
+    """Returns a map from the ids of the members of the classes of the
+    parent of the given ClassBase to their persistent ids.
+
+    """
+    members = {}
+    for class_name in parent_class_names(classbase):
+        class_defn = classbase.lookup_class_defn(class_name)
+        for (name, prop_defn) in class_defn.prop_defn_map.items():
+            members[id(prop_defn)] = ("prop", class_name, name)
+        for (name, method_defn) in class_defn.method_defn_map.items():
+            members[id(method_defn)] = ("method", class_name, name)
+            for (param_name, param_decl) in \
+              method_defn.param_decl_map.items():
+                members[id(param_decl)] = ("param", class_name, name,
+                                           param_name)
+    return members
+
+
+def dump_classes(pickler, classbase):
+    """Pickles the classes of the given overlay ClassBase (but not those of
+    its parent) with the given ClassBasePickler.
+
+    """
+    class_names = classbase.class_names
+    states = [classbase.class_defn_map[class_name].__getstate__()
+              for class_name in class_names]
+    pickler.dump(class_names)
+    pickler.dump(states)
+
+
+def load_classes(unpickler, classbase):
+    """Unpickles the classes pickled by dump_classes with the given
+    ClassBaseUnpickler, and adds them to the given overlay ClassBase.  (The
+    classes of the parent are frozen, so the new classes are not
+    registered with them as subclasses.)
+
+    """
+    class_names = unpickler.load()
+    for class_name in class_names:
+        # an empty ClassDefn, which is filled in when the cache is loaded
+        unpickler.shells[class_name] = ClassDefn.__new__(ClassDefn)
+    # nothing loaded can be garbage yet, so don't go looking for any
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        states = unpickler.load()
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    for (class_name, state) in zip(class_names, states):
+        class_defn = unpickler.shells[class_name]
+        class_defn.__setstate__(state)
+        classbase.class_defn_map[class_name] = class_defn
+        classbase.class_names.append(class_name)
+
+
+def save_cache(filename, key, classbase):
+    """Writes the classes of the given overlay ClassBase (but not those of
+    its parent) to the named cache file.
+
+    """
+    # named for this process, so that no other can be writing it
+    temporary = "%s.%d.new" % (filename, os.getpid())
+    try:
+        f = open(temporary, "wb")
+        try:
+            f.write(MAGIC + b" " + key + b"\n")
+            dump_classes(ClassBasePickler(f, member_ids(classbase)),
+                         classbase)
+        finally:
+            f.close()
+        replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def load_cache(filename, key, classbase):
+    """Adds the classes in the named cache file to the given overlay
+    ClassBase, and returns True, if the file exists, has the given key,
+    and can be unpickled.  Otherwise returns False, having added nothing.
+
+    """
+    try:
+        f = open(filename, "rb")
+    except EnvironmentError:
+        return False
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    header_end = data.find(b"\n")
+    if data[:header_end] != MAGIC + b" " + key:
+        return False
+    unpickler = ClassBaseUnpickler(BytesIO(data[header_end + 1:]), classbase)
+    count = len(classbase.class_names)
+    try:
+        load_classes(unpickler, classbase)
+    except UNPICKLING_ERRORS:
+        # a damaged cache file; forget whatever was added from it
+        for class_name in classbase.class_names[count:]:
+            del classbase.class_defn_map[class_name]
+        del classbase.class_names[count:]
+        return False
+    return True
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Whole-program typechecker for the Unlikely programming language.
+
+Normally each class, construction and continue is typechecked as soon as
+it has been parsed.  A source can instead be parsed with typechecking
+left out (see parser.py), and then checked by a Checker, in one pass
+over the whole ClassBase, which raises the same errors the checks made
+while parsing would have (though, when there is more than one error, not
+necessarily the same one first.)
+
+The pass visits the classes in hierarchy order, superclasses first, and
+works out what it needs to know about each class only once: where it
+lies in the hierarchy (so whether one class is a subclass of another is
+a matter of comparing two numbers, rather than walking up the
+hierarchy), which of its methods are abstract (shared with its
+superclass, where it doesn't change that), and the types of the
+parameters of its methods and of its dependants.
+"""
+
+from .ast import (IncompatibleTypeError, ClassRelationshipError,
+                  Construction)
+
+
+class Checker(object):
+    """
+    Typechecks the classes of a ClassBase after it has been parsed.
+    """
+
+    def __init__(self, classbase):
+        self.classbase = classbase
+        self.order = []
+        self.first = {}
+        self.last = {}
+        self.abstract_method_names = {}
+        self.param_types = {}
+        self.dependants = {}
+
+    def number(self):
+        """Numbers the classes of the ClassBase and its parents in
+        hierarchy order (depth first, superclasses first), noting the
+        range of numbers of the subclasses of each.
+
+        """
+        classbase = self.classbase
+        class_defns = [classbase.lookup_class_defn(class_name)
+                       for class_name in classbase.get_all_class_names()]
+        known = set(class_defns)
+        children = {}
+        roots = []
+        for class_defn in class_defns:
+            if class_defn.superclass in known:
+                children.setdefault(class_defn.superclass,
+                                    []).append(class_defn)
+            else:
+                roots.append(class_defn)
+        counter = 0
+        for root in roots:
+            pending = [(root, False)]
+            while pending:
+                (class_defn, done) = pending.pop()
+                if done:
+                    self.last[class_defn] = counter
+                    continue
+                self.first[class_defn] = counter
+                counter += 1
+                self.order.append(class_defn)
+                pending.append((class_defn, True))
+                for child in reversed(children.get(class_defn, ())):
+                    pending.append((child, False))
+
+    def is_subclass_of(self, class_defn, other):
+        # constant classes aren't numbered, but their superclasses are
+        while class_defn is not None and class_defn not in self.first:
+            if class_defn is other:
+                return True
+            class_defn = class_defn.superclass
+        if class_defn is None or other not in self.first:
+            return False
+        return (self.first[other] <= self.first[class_defn] and
+                self.first[class_defn] < self.last[other])
+
+    def summarize(self, class_defn):
+        """Works out which methods of the given class are abstract, from
+        those of its superclass, which has already been summarized.
+
+        """
+        superclass = class_defn.superclass
+        names = self.abstract_method_names.get(superclass, frozenset())
+        for (method_name, method_defn) in class_defn.method_defn_map.items():
+            is_abstract = method_defn.has_modifier("abstract")
+            if is_abstract != (method_name in names):
+                names = set(names)
+                if is_abstract:
+                    names.add(method_name)
+                else:
+                    names.discard(method_name)
+        self.abstract_method_names[class_defn] = names
+
+    def get_param_types(self, method_defn):
+        if method_defn not in self.param_types:
+            self.param_types[method_defn] = tuple([
+                method_defn.param_decl_map[param_name].type_class_defn
+                for param_name in method_defn.param_names
+            ])
+        return self.param_types[method_defn]
+
+    def get_dependants(self, class_defn):
+        if class_defn not in self.dependants:
+            self.dependants[class_defn] = tuple([
+                class_defn.dependant_map[dependant_name]
+                for dependant_name in class_defn.dependant_names
+            ])
+        return self.dependants[class_defn]
+
+    def check(self):
+        """Typechecks every class of the ClassBase (but not of its
+        parents), and everything its methods construct and continue.
+
+        """
+        self.number()
+        class_defn_map = self.classbase.class_defn_map
+        for class_defn in self.order:
+            self.summarize(class_defn)
+            if class_defn_map.get(class_defn.name) is not class_defn:
+                continue
+            if class_defn.defined:
+                self.check_class_defn(class_defn)
+            for method_defn in class_defn.method_defn_map.values():
+                for assignment in method_defn.assignments:
+                    if isinstance(assignment.rhs, Construction):
+                        self.check_construction(assignment.rhs)
+                continue_ = method_defn.continue_
+                if continue_ is not None:
+                    for param_expr in continue_.param_exprs:
+                        if isinstance(param_expr, Construction):
+                            self.check_construction(param_expr)
+                    self.check_continue(continue_)
+
+    def check_class_defn(self, class_defn):
+        names = self.abstract_method_names[class_defn]
+        if not class_defn.has_modifier("abstract"):
+            if len(names) > 0:
+                # name the one the check made while parsing would have
+                for method_name in class_defn.find_all_method_defns():
+                    if method_name in names:
+                        message = ("concrete class " + class_defn.name +
+                                   " does not implement abstract method " +
+                                   method_name)
+                        raise ClassRelationshipError(message)
+        elif len(names) == 0:
+            raise ClassRelationshipError("abstract class " +
+                                         class_defn.name +
+                                         " has no abstract methods")
+
+    def check_construction(self, construction):
+        type_class_defn = construction.type_class_defn
+        dependants = self.get_dependants(type_class_defn)
+        if len(construction.dependencies) != len(dependants):
+            message = ("instantiation specifies " +
+                       str(len(construction.dependencies)) + " classes, " +
+                       str(len(dependants)) + " needed (" +
+                       ",".join(type_class_defn.dependant_names) + ")")
+            raise IncompatibleTypeError(message)
+        for (dependency, dependant_class_defn) in \
+          zip(construction.dependencies, dependants):
+            if not self.is_subclass_of(dependency, dependant_class_defn):
+                message = (dependency.name + " not a subclass of " +
+                           dependant_class_defn.name)
+                raise IncompatibleTypeError(message)
+
+    def check_continue(self, continue_):
+        param_types = self.get_param_types(continue_.target_method_defn)
+        if len(continue_.param_exprs) != len(param_types):
+            message = ("continue provides " +
+                       str(len(continue_.param_exprs)) + " params, " +
+                       str(len(param_types)) + " needed")
+            raise IncompatibleTypeError(message)
+        for (param_expr, param_type_class_defn) in \
+          zip(continue_.param_exprs, param_types):
+            arg_type_class_defn = param_expr.get_type_class_defn()
+            if not self.is_subclass_of(arg_type_class_defn,
+                                       param_type_class_defn):
+                message = (arg_type_class_defn.name + " not a subclass of " +
+                           param_type_class_defn.name)
+                raise IncompatibleTypeError(message)
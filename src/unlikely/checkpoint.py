@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Checkpoints of running Unlikely programs.
+
+Everything a running program knows is in the objects reachable from the
+continuation it is about to continue (its accumulator included), so a
+program which has been suspended (see interpreter.py) can be saved by
+saving those, and resumed later, in another process even, from a copy of
+them.
+
+A CheckpointLog keeps checkpoints in a file which is only ever appended
+to.  It starts with a header line giving a key (see cache.py), which
+covers the classes of the program too.  Each checkpoint follows, as a
+length and two pickles: the first checkpoint holds every object, and each
+after it only those which are new, or have changed, since the one before,
+and the serial numbers of those which are no longer reachable.  The
+classes of the objects, and their injections, are numbered as they are
+first written; the classes are pickled by name, in a pickle of their own,
+and refer to those of the loaded ClassBase when the checkpoint is read
+back.  Once the log has grown to several times the size of the program, it
+is rewritten, holding just one checkpoint of everything.
+
+Objects are known from one checkpoint to the next by their ids, without
+being kept alive in between.  An object which has been freed, and whose
+id has been taken by a new one, is taken for the old one, and written
+again only if it differs; that is harmless, since nothing can refer to
+the old one any more.  Finding what has changed means looking at every
+object reachable, but only what has changed is written.
+"""
+
+import gc
+import os
+import struct
+from io import BytesIO
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .cache import (ClassBasePickler, ClassBaseUnpickler, format_key,
+                    UNPICKLING_ERRORS)
+from .runtime import Instance, box
+
+
+FORMAT_VERSION = 1
+MAGIC = b"UNLIKELYK"
+
+# Once more objects than this many times those reachable have been
+# written to a log, it is rewritten.
+COMPACT_RATIO = 4
+
+replace = getattr(os, "replace", os.rename)
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a checkpoint log was not written for the program it is
+    being read back into, or is damaged, or when there is no suspended
+    program to write.
+    """
+    pass
+
+
+def checkpoint_key(classbase):
+    """Returns the key of a checkpoint log of a program whose classes are
+    those of the given overlay ClassBase.
+
+    """
+    return format_key(FORMAT_VERSION, classbase,
+                      *[str(classbase.class_defn_map[class_name])
+                        .encode("utf-8")
+                        for class_name in classbase.class_names])
+
+
+class CheckpointLog(object):
+    """
+    A log of checkpoints of a program whose classes are those of the given
+    overlay ClassBase, kept in the named file.  If the file already holds
+    a log, it is read, and the last checkpoint in it can be restored, and
+    written on from; otherwise a new log is started.
+
+    objects maps the ids of the objects last written to their serial
+    numbers and the records written for them; classes maps the ids of the
+    classes written to them and their indices, and injections the
+    injections written (as sorted tuples of names and the indices of
+    classes) to theirs.  Each record gives the index of the class of the
+    object, the index of its injections, its value,
+    its slots (with objects replaced by their serial numbers), a mask of
+    which slots those are, and a mask of which hold booleans (so that a
+    record holding True is not taken to be the same as one holding 1.)
+    fresh is False while objects does not describe what is in the log.
+    """
+
+    def __init__(self, filename, classbase):
+        self.filename = filename
+        self.classbase = classbase
+        self.header = MAGIC + b" " + checkpoint_key(classbase) + b"\n"
+        self.objects = {}
+        self.classes = {}
+        self.injections = {}
+        self.injection_ids = {}
+        self.next_serial = 0
+        self.written = 0
+        self.written_now = 0
+        self.fresh = True
+        self.continuations = 0
+        self.last = None
+        self.records = {}
+        self.class_table = {}
+        self.injection_table = {}
+        self.file = None
+        if os.path.exists(filename):
+            self.read()
+        else:
+            self.start()
+
+    def start(self):
+        """Starts a new, empty log."""
+        self.file = open(self.filename, "wb")
+        self.file.write(self.header)
+        self.file.flush()
+
+    def read(self):
+        """Reads every checkpoint in the log, and leaves it open to be
+        appended to.  A checkpoint which was cut off as it was being
+        written is cut off the file.
+
+        """
+        f = open(self.filename, "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        header_end = data.find(b"\n") + 1
+        if data[:header_end] != self.header:
+            raise CheckpointError(self.filename + " is not a checkpoint of "
+                                  "this program")
+        position = header_end
+        while position + 4 <= len(data):
+            (size,) = struct.unpack("<I", data[position:position + 4])
+            if position + 4 + size > len(data):
+                break
+            stream = BytesIO(data[position + 4:position + 4 + size])
+            # cPickle, where it is used, has an UnpicklingError of its own
+            try:
+                classes = ClassBaseUnpickler(stream, self.classbase).load()
+                checkpoint = pickle.load(stream)
+            except UNPICKLING_ERRORS + (pickle.UnpicklingError,):
+                raise CheckpointError(self.filename + " is damaged")
+            self.apply(classes, checkpoint)
+            position += 4 + size
+        self.file = open(self.filename, "r+b")
+        self.file.seek(position)
+        self.file.truncate()
+        self.fresh = False
+
+    def apply(self, classes, checkpoint):
+        (continuations, method_name, root, injections, records,
+         dropped) = checkpoint
+        self.class_table.update(classes)
+        self.injection_table.update(injections)
+        for record in records:
+            self.records[record[0]] = record[1:]
+        for serial in dropped:
+            del self.records[serial]
+        self.written += len(records)
+        self.continuations = continuations
+        self.last = (root, method_name)
+
+    def restore(self, interpreter):
+        """Leaves a copy of the program, as it was at the last checkpoint
+        in the log, suspended in the given Interpreter, ready to be
+        resumed.  Returns False if there is no checkpoint to restore.
+
+        """
+        if self.last is None:
+            return False
+        (root, method_name) = self.last
+        class_table = self.class_table
+        records = self.records
+        # injections are shared, as the compiler shares them (see
+        # Compiler.compile_constructor)
+        interned = interpreter.compiler.interned_injections
+        shared = {}
+        instances = {}
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            pending = [root]
+            while pending:
+                serial = pending.pop()
+                if serial in instances:
+                    continue
+                (class_index, injections, value, slots, mask, booleans) = \
+                  records[serial]
+                key = (class_index, injections)
+                if key not in shared:
+                    class_defn = class_table[class_index]
+                    items = tuple([(name, class_table[index]) for (name, index)
+                                   in self.injection_table[injections]])
+                    shared[key] = (class_defn, interned.setdefault(
+                        (class_defn, items), dict(items)))
+                (class_defn, injections) = shared[key]
+                instances[serial] = Instance(class_defn, injections, value)
+                index = 0
+                while mask >> index:
+                    if mask & (1 << index):
+                        pending.append(slots[index])
+                    index += 1
+            objects = {}
+            for (serial, instance) in instances.items():
+                record = records[serial]
+                (slots, mask) = record[3:5]
+                if mask:
+                    slots = [instances[slots[index]]
+                             if mask & (1 << index) else slots[index]
+                             for index in range(len(slots))]
+                instance.slots[:] = slots
+                objects[id(instance)] = [serial, record]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self.objects = objects
+        self.classes = dict([(id(class_defn), (class_defn, index))
+                             for (index, class_defn) in class_table.items()])
+        self.injections = dict([(items, index) for (index, items)
+                                in self.injection_table.items()])
+        self.injection_ids = {}
+        self.next_serial = max(records) + 1
+        self.fresh = True
+        interpreter.suspended = (instances[root], method_name)
+        self.continuations -= interpreter.continuations
+        # the log only needs what is still reachable from here on
+        self.records = {}
+        self.class_table = {}
+        self.injection_table = {}
+        return True
+
+    def write(self, interpreter):
+        """Appends a checkpoint of the program suspended in the given
+        Interpreter to the log (or rewrites the log, holding just that
+        checkpoint, if it has grown too long.)  Returns the number of
+        objects written.
+
+        """
+        if interpreter.suspended is None:
+            raise CheckpointError("there is no suspended program to write")
+        if (not self.fresh or
+            self.written > COMPACT_RATIO * max(len(self.objects), 1)):
+            return self.rewrite(interpreter)
+        data = self.dump(interpreter)
+        self.file.write(struct.pack("<I", len(data)))
+        self.file.write(data)
+        self.file.flush()
+        return self.written_now
+
+    def rewrite(self, interpreter):
+        """Rewrites the log, holding just a checkpoint of everything in the
+        program suspended in the given Interpreter.
+
+        """
+        self.objects = {}
+        self.classes = {}
+        self.injections = {}
+        self.injection_ids = {}
+        self.next_serial = 0
+        self.written = 0
+        self.fresh = True
+        data = self.dump(interpreter)
+        temporary = self.filename + ".new"
+        f = open(temporary, "wb")
+        try:
+            f.write(self.header)
+            f.write(struct.pack("<I", len(data)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        self.file.close()
+        replace(temporary, self.filename)
+        self.file = open(self.filename, "ab")
+        return self.written_now
+
+    def class_index(self, class_defn, classes):
+        """Returns the index of the given class, numbering it (and adding
+        it to the given list of new classes) if it has none yet.
+
+        """
+        entry = self.classes.get(id(class_defn))
+        if entry is None:
+            entry = (class_defn, len(self.classes))
+            self.classes[id(class_defn)] = entry
+            classes.append((entry[1], class_defn))
+        return entry[1]
+
+    def injections_index(self, injections, classes, new_injections):
+        """Returns the index of the given injections, numbering them (and
+        adding them to the given list of new injections) if they have
+        none yet.  (Injections are shared, so the index is remembered for
+        the dict itself, which is kept alive so that its id is not reused.)
+
+        """
+        entry = self.injection_ids.get(id(injections))
+        if entry is not None:
+            return entry[1]
+        key = tuple(sorted([(name, self.class_index(class_defn, classes))
+                            for (name, class_defn) in injections.items()]))
+        index = self.injections.get(key)
+        if index is None:
+            index = len(self.injections)
+            self.injections[key] = index
+            new_injections.append((index, key))
+        self.injection_ids[id(injections)] = (injections, index)
+        return index
+
+    def dump(self, interpreter):
+        """Returns a pickle of what has changed in the program suspended in
+        the given Interpreter since the last checkpoint.
+
+        """
+        (instance, method_name) = interpreter.suspended
+        if type(instance) is not Instance:
+            instance = box(instance)
+        old = self.objects
+        old_get = old.get
+        objects = {}
+        objects_get = objects.get
+        records = []
+        classes = []
+        injections = []
+        entry = old_get(id(instance))
+        if entry is not None:
+            root = entry[0]
+        else:
+            root = self.next_serial
+            self.next_serial += 1
+        objects[id(instance)] = [root, None]
+        pending = [instance]
+        class_ids = self.classes
+        injection_ids = self.injection_ids
+        next_serial = self.next_serial
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while pending:
+                obj = pending.pop()
+                key = id(obj)
+                slots = list(obj.slots)
+                mask = 0
+                booleans = 0
+                position = 0
+                for value in slots:
+                    if type(value) is Instance:
+                        entry = objects_get(id(value))
+                        if entry is None:
+                            entry = old_get(id(value))
+                            if entry is not None:
+                                entry = [entry[0], None]
+                            else:
+                                entry = [next_serial, None]
+                                next_serial += 1
+                            objects[id(value)] = entry
+                            pending.append(value)
+                        slots[position] = entry[0]
+                        mask |= 1 << position
+                    elif type(value) is bool:
+                        booleans |= 1 << position
+                    position += 1
+                # classes and injections are nearly always numbered already
+                class_entry = class_ids.get(id(obj.class_defn))
+                if class_entry is None:
+                    self.class_index(obj.class_defn, classes)
+                    class_entry = class_ids[id(obj.class_defn)]
+                injections_entry = injection_ids.get(id(obj.injections))
+                if injections_entry is None:
+                    self.injections_index(obj.injections, classes,
+                                          injections)
+                    injections_entry = injection_ids[id(obj.injections)]
+                record = (class_entry[1], injections_entry[1], obj.value,
+                          tuple(slots), mask, booleans)
+                entry = objects[key]
+                entry[1] = record
+                previous = old_get(key)
+                if previous is None or previous[1] != record:
+                    records.append((entry[0],) + record)
+            dropped = [entry[0] for (key, entry) in old.items()
+                       if key not in objects]
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self.next_serial = next_serial
+        self.objects = objects
+        self.written += len(records)
+        self.written_now = len(records)
+        stream = BytesIO()
+        ClassBasePickler(stream, {}).dump(classes)
+        pickle.dump((self.continuations + interpreter.continuations,
+                     method_name, root, injections, records, dropped),
+                    stream, 2)
+        return stream.getvalue()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
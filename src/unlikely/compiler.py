@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Closure compiler for the Unlikely programming language.
+
+Each method definition is lowered, once, into a Python closure which takes
+the instance the method was continued on, performs the method's
+assignments, passes the arguments of its continue, and returns the
+instance and method name to be continued next.  Property names, classes
+to construct and goto targets are all looked up while compiling, so that
+running a method does not touch the AST at all.  A qualified name becomes
+a tuple of slot indices into the instances along its path.
+
+Constructing a passive value (an integer, string or boolean constant)
+yields the Python value itself rather than an Instance, unless it may end
+up, by way of any number of copies, in a property which the program (or a
+built-in class) reads or assigns properties of, or continues.  Such a
+value is boxed at once, so that every copy of it shares the box; and such
+a value which was not constructed boxed (one passed in the accumulator,
+say) is boxed, in place, as it is read (see runtime.container_at), so
+that the copies made of it from then on share the box too.  Anywhere
+else, nothing can tell a copy of a passive value from the value itself.
+
+A method which builds a chain of built-in continuations and continues it
+at once is compiled, where it can be, into a single closure which runs the
+whole chain (see fusion.py.)  Such a closure is known to the trampoline,
+which counts it as the number of continuations it stands for.
+
+When the compiler is given a Profile (see profiler.py), the closures it
+puts in the dispatch tables, and those which construct objects, are
+wrapped in ones which count how often they run.
+"""
+
+from .ast import Construction
+from .fusion import count_uses, find_chain
+from .runtime import (Instance, AbstractMethodError, unassigned,
+                      container_at, box, value_of_class_defn)
+from . import stdlib
+
+
+# The properties of the built-in classes which their natives continue.
+NATIVE_CONTAINERS = (stdlib.chain.lookup_prop_defn("next"),
+                     stdlib.branch.lookup_prop_defn("else"),
+                     stdlib.while_loop.lookup_prop_defn("test"))
+
+
+def identity_injections(class_defn):
+    """Returns the injections of an instance of the given class for which
+    every dependant class was injected as itself.
+
+    """
+    injections = {}
+    for dependant_name in class_defn.dependant_names:
+        injections[dependant_name] = class_defn.dependant_map[dependant_name]
+    return injections
+
+
+def slot_indices(qual_name):
+    return tuple([prop_defn.get_slot_index()
+                  for prop_defn in qual_name.prop_defns])
+
+
+def find_containers(method_defn, containers):
+    """Adds the properties whose own properties the given method reads or
+    assigns, or which it continues, to the given set.
+
+    """
+    for assignment in method_defn.assignments:
+        containers.update(assignment.lhs.prop_defns[:-1])
+        if not isinstance(assignment.rhs, Construction):
+            containers.update(assignment.rhs.prop_defns[:-1])
+    for param_expr in method_defn.continue_.param_exprs:
+        if not isinstance(param_expr, Construction):
+            containers.update(param_expr.prop_defns[:-1])
+    containers.add(method_defn.continue_.prop_defn)
+
+
+def find_copies(method_defn, copies):
+    """Adds, to the sets in the given dict, the properties into which the
+    given method copies the value of each property it copies, keyed by the
+    property copied.
+
+    """
+    for assignment in method_defn.assignments:
+        if not isinstance(assignment.rhs, Construction):
+            copies.setdefault(assignment.rhs.prop_defns[-1], set()).add(
+                assignment.lhs.prop_defns[-1])
+    continue_ = method_defn.continue_
+    target_method_defn = continue_.target_method_defn
+    for (param_name, param_expr) in zip(target_method_defn.param_names,
+                                        continue_.param_exprs):
+        if not isinstance(param_expr, Construction):
+            copies.setdefault(param_expr.prop_defns[-1], set()).add(
+                target_method_defn.lookup_prop_defn(param_name))
+
+
+def find_boxed(containers, copies):
+    """Returns the properties whose values must be boxed: the given
+    containers, the properties of the built-in classes which are
+    containers, and every property whose value is copied into one of
+    those, or into a property whose value is, and so on.
+
+    """
+    boxed = set(containers)
+    boxed.update(NATIVE_CONTAINERS)
+    changed = True
+    while changed:
+        changed = False
+        for (prop_defn, targets) in copies.items():
+            if prop_defn not in boxed and not boxed.isdisjoint(targets):
+                boxed.add(prop_defn)
+                changed = True
+    return boxed
+
+
+class Compiler(object):
+    """
+    Compiles method definitions into closures, and keeps the per-class
+    dispatch tables mapping method names to them.
+    """
+
+    def __init__(self, natives, intrinsics=None, profile=None):
+        """natives maps built-in classes to the Python functions which
+        implement their (otherwise abstract) methods.  intrinsics maps the
+        built-in classes which may be fused to a pair: the names of the
+        properties (other than next) each reads, and a Python function
+        which takes the accumulator and the values of those properties,
+        and returns the accumulator to pass to next.  profile, if given,
+        is the Profile to count continuations and constructions in.
+
+        """
+        self.natives = natives
+        self.intrinsics = intrinsics or {}
+        self.fusable = {}
+        for (class_defn, (names, function)) in self.intrinsics.items():
+            self.fusable[class_defn] = names
+        self.compiled = {}
+        self.dispatch = {}
+        self.interned_injections = {}
+        self.containers = set()
+        self.copies = {}
+        self.boxed = find_boxed(self.containers, self.copies)
+        self.uses = {}
+        self.fused = {}
+        self.profile = profile
+
+    def compile_class_base(self, classbase):
+        method_defns = []
+        for class_defn in classbase.class_defn_map.values():
+            for method_defn in class_defn.method_defn_map.values():
+                if method_defn.continue_ is not None:
+                    method_defns.append(method_defn)
+        self.compile_method_defns(method_defns)
+
+    def compile_method_defns(self, method_defns, methods=None):
+        """Compiles the given method definitions.  methods, if given, maps
+        them to closures already built for them (by a VM, say), which are
+        used in place of compiling them, though they may still be fused.
+
+        """
+        methods = methods or {}
+        for method_defn in method_defns:
+            find_containers(method_defn, self.containers)
+            find_copies(method_defn, self.copies)
+            count_uses(method_defn, self.uses)
+        self.boxed = find_boxed(self.containers, self.copies)
+        for method_defn in method_defns:
+            self.compile_method_defn(method_defn, methods.get(method_defn))
+
+    def lookup(self, class_defn, method_name):
+        """Returns the closure to run when the named method is continued on
+        an instance of the given class, adding it to the dispatch table.
+
+        """
+        table = self.dispatch.setdefault(class_defn, {})
+        if method_name in table:
+            return table[method_name]
+        method_defn = class_defn.lookup_method_defn(method_name)
+        if method_defn.continue_ is not None:
+            method = self.compile_method_defn(method_defn)
+        else:
+            method = self.find_native(class_defn, method_defn)
+        if self.profile is not None:
+            method = self.profile.count_method(class_defn, method_name,
+                                               method, self.fused)
+        table[method_name] = method
+        return method
+
+    def find_native(self, class_defn, method_defn):
+        superclass = class_defn
+        while superclass is not None:
+            if superclass in self.natives:
+                return self.natives[superclass]
+            superclass = superclass.superclass
+        message = class_defn.name + "." + method_defn.name
+
+        def abstract(instance):
+            raise AbstractMethodError(message)
+        return abstract
+
+    def compile_method_defn(self, method_defn, method=None):
+        if method_defn in self.compiled:
+            return self.compiled[method_defn]
+        if method is None:
+            method = self.compile_plain(method_defn)
+        chain = find_chain(method_defn, self.uses, self.fusable)
+        if chain is not None:
+            method = self.compile_chain(method_defn, chain, method)
+        self.compiled[method_defn] = method
+        return method
+
+    def compile_plain(self, method_defn):
+        steps = tuple([self.compile_assignment(assignment)
+                       for assignment in method_defn.assignments])
+        goto = self.compile_continue(method_defn.continue_)
+        if len(steps) == 0:
+            return goto
+
+        def method(instance):
+            for step in steps:
+                step(instance)
+            return goto(instance)
+        return method
+
+    def compile_chain(self, method_defn, chain, plain):
+        """Compiles the given method, which continues the given fusable
+        chain, into a closure which runs the chain too, and returns the
+        continuation after it.  Where the instance was given other classes
+        than the built-in ones to construct the chain from, the closure
+        falls back to the unfused closure given.
+
+        """
+        steps = tuple([self.compile_assignment(assignment)
+                       for (index, assignment)
+                       in enumerate(method_defn.assignments)
+                       if index not in chain.skipped])
+        continue_ = method_defn.continue_
+        arg = self.compile_expr(continue_.param_exprs[0])
+        target_method_defn = continue_.target_method_defn
+        accumulator_index = target_method_defn.lookup_prop_defn(
+            target_method_defn.param_names[0]).get_slot_index()
+        # the properties of the links (other than the links between them)
+        # are all read before the chain is run, in the order they were
+        # assigned, as they would have been
+        fields = [chain.links[-1].fields["next"]]
+        for link in chain.links:
+            fields.extend([field for (name, field) in link.fields.items()
+                           if name != "next"])
+        fields.sort(key=lambda field: field[0])
+        positions = dict([(index, position) for (position, (index, expr))
+                          in enumerate(fields)])
+        next_index = chain.links[-1].fields["next"][0]
+        reads = tuple([self.compile_expr(expr, index == next_index)
+                       for (index, expr) in fields])
+        next_position = positions[next_index]
+        ops = []
+        injected = []
+        for link in chain.links:
+            (names, function) = self.intrinsics[link.class_defn]
+            ops.append(self.compile_link(function, [
+                positions[link.fields[name][0]] for name in names
+            ]))
+            if link.class_defn.must_be_injected():
+                injected.append((link.class_defn.name, link.class_defn))
+        ops = tuple(ops)
+        checked = [None]
+
+        def guard(injections):
+            if injections is checked[0]:
+                return True
+            for (class_name, class_defn) in injected:
+                if injections.get(class_name, class_defn) is not class_defn:
+                    return False
+            checked[0] = injections
+            return True
+
+        def fused(instance):
+            if not guard(instance.injections):
+                return plain(instance)
+            for step in steps:
+                step(instance)
+            values = [read(instance) for read in reads]
+            accumulator = arg(instance)
+            for op in ops:
+                accumulator = op(accumulator, values)
+            next_ = values[next_position]
+            if type(next_) is not Instance:
+                next_ = box(next_)
+            next_.slots[accumulator_index] = accumulator
+            return (next_, "continue")
+        self.fused[fused] = (1 + len(chain.links), plain, guard,
+                             tuple([link.class_defn
+                                    for link in chain.links]))
+        return fused
+
+    def compile_link(self, function, positions):
+        if len(positions) == 0:
+            def op(accumulator, values):
+                return function(accumulator)
+        elif len(positions) == 1:
+            position = positions[0]
+
+            def op(accumulator, values):
+                return function(accumulator, values[position])
+        else:
+            def op(accumulator, values):
+                return function(accumulator,
+                                *[values[position]
+                                  for position in positions])
+        return op
+
+    def compile_assignment(self, assignment):
+        lhs = assignment.lhs.prop_defns[-1]
+        evaluate = self.compile_expr(assignment.rhs, lhs in self.boxed)
+        indices = slot_indices(assignment.lhs)
+        index = indices[-1]
+        if len(indices) == 1:
+            def assign(instance):
+                instance.slots[index] = evaluate(instance)
+        else:
+            container = self.compile_container(indices[:-1])
+
+            def assign(instance):
+                container(instance).slots[index] = evaluate(instance)
+        return assign
+
+    def compile_expr(self, expr, boxed=False):
+        if isinstance(expr, Construction):
+            return self.compile_construction(expr, boxed)
+        indices = slot_indices(expr)
+        if expr.prop_defns[-1] in self.boxed:
+            return self.compile_container(indices)
+        return self.compile_path(indices)
+
+    def compile_path(self, indices):
+        """Compiles a reference to the property at the end of the given
+        path of slot indices, boxing passive values along the way (but not
+        at the end of it.)
+
+        """
+        index = indices[-1]
+        if len(indices) == 1:
+            def read(instance):
+                value = instance.slots[index]
+                if value is None:
+                    raise unassigned(instance, index)
+                return value
+            return read
+        container = self.compile_container(indices[:-1])
+
+        def read_path(instance):
+            instance = container(instance)
+            value = instance.slots[index]
+            if value is None:
+                raise unassigned(instance, index)
+            return value
+        return read_path
+
+    def compile_container(self, indices):
+        """Compiles a reference to the object at the end of the given path
+        of slot indices, boxing passive values along the way.
+
+        """
+        if len(indices) == 1:
+            index = indices[0]
+
+            def read(instance):
+                value = instance.slots[index]
+                if type(value) is Instance:
+                    return value
+                return container_at(instance, index)
+            return read
+
+        def read_path(instance):
+            for index in indices:
+                instance = container_at(instance, index)
+            return instance
+        return read_path
+
+    def compile_construction(self, construction, boxed=False):
+        return self.compile_constructor(construction.type_class_defn,
+                                        construction.dependencies, boxed)
+
+    def compile_constructor(self, static_class_defn, dependencies,
+                            boxed=False):
+        """Compiles a construction of the given class, with the given
+        classes as its dependencies.  The classes it instantiates and
+        injects depend only on the injections of the instance doing the
+        constructing, so the result for the most recent of those is
+        remembered; and since injections are never modified once made,
+        equal ones are shared between instances.  Unless boxed is given,
+        a passive value is constructed as the bare Python value.
+
+        """
+        class_name = static_class_defn.name
+        is_injected = static_class_defn.must_be_injected()
+        value = value_of_class_defn(static_class_defn)
+        if value is not None and not is_injected and not boxed:
+            def constant(instance):
+                return value
+            if self.profile is not None:
+                return self.profile.count_construction(static_class_defn,
+                                                       constant)
+            return constant
+        dependencies = tuple(zip(static_class_defn.dependant_names,
+                                 [dependency.name for dependency
+                                  in dependencies],
+                                 dependencies))
+        interned = self.interned_injections
+        last = [None, None, None]
+
+        def construct(instance):
+            creator_injections = instance.injections
+            if creator_injections is not last[0]:
+                resolve = creator_injections.get
+                if is_injected:
+                    class_defn = resolve(class_name, static_class_defn)
+                else:
+                    class_defn = static_class_defn
+                injections = identity_injections(class_defn)
+                for (dependant_name, name, dependency) in dependencies:
+                    injections[dependant_name] = resolve(name, dependency)
+                key = (class_defn, tuple(sorted(injections.items(),
+                                                key=lambda item: item[0])))
+                injections = interned.setdefault(key, injections)
+                last[:] = [creator_injections, class_defn, injections]
+            return Instance(last[1], last[2], value)
+        if self.profile is not None:
+            return self.profile.count_construction(static_class_defn,
+                                                   construct)
+        return construct
+
+    def compile_continue(self, continue_):
+        target = self.compile_container(
+            (continue_.prop_defn.get_slot_index(),))
+        target_method_defn = continue_.target_method_defn
+        method_name = target_method_defn.name
+        param_prop_defns = [target_method_defn.lookup_prop_defn(param_name)
+                            for param_name in target_method_defn.param_names]
+        param_indices = tuple([prop_defn.get_slot_index()
+                               for prop_defn in param_prop_defns])
+        args = tuple([self.compile_expr(param_expr,
+                                        prop_defn in self.boxed)
+                      for (param_expr, prop_defn)
+                      in zip(continue_.param_exprs, param_prop_defns)])
+        if len(args) == 0:
+            def goto(instance):
+                return (target(instance), method_name)
+        elif len(args) == 1:
+            param_index = param_indices[0]
+            arg = args[0]
+
+            def goto(instance):
+                value = arg(instance)
+                next_ = target(instance)
+                next_.slots[param_index] = value
+                return (next_, method_name)
+        else:
+            params = tuple(zip(param_indices, args))
+
+            def goto(instance):
+                values = [(param_index, arg(instance))
+                          for (param_index, arg) in params]
+                next_ = target(instance)
+                for (param_index, value) in values:
+                    next_.slots[param_index] = value
+                return (next_, method_name)
+        return goto
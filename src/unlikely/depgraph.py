@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Class dependency graph, for rechecking Unlikely sources incrementally.
+
+A source is split into its class declarations (each starting with a
+"class" outside of any braces; a class which is declared forward and then
+defined has two), and each class gets a digest of the tokens of its
+declarations.  Once the source has been checked, the graph records, for
+each class the source defined, the other classes of the source which it
+refers to: its superclass, its dependants, the types of its properties
+and parameters, the classes its methods construct and inject, and the
+classes whose properties and methods they use.
+
+When the source has been edited, only the classes whose declarations
+changed (or moved relative to the classes they refer to), and the classes
+which refer to those, however indirectly, are parsed and checked again.
+The others are kept in the overlay ClassBase just as they were.  Where a
+declaration can't be checked by itself exactly as it would have been in
+the whole source, the whole source is checked instead.
+"""
+
+import bisect
+import hashlib
+
+from .ast import (ClassBase, Construction, ArtefactExistsError,
+                  ArtefactNotFoundError, BadModifierError,
+                  IncompatibleTypeError, ClassRelationshipError)
+from .parser import ClassDefnParser
+from .scanner import scan_tokens, TokenScanner
+
+
+class Reparse(Exception):
+    """An exception indicating that a declaration could not be rechecked by
+    itself, so the whole source must be checked instead.
+
+    """
+    pass
+
+
+class FragmentScanner(TokenScanner):
+    """
+    A TokenScanner over the tokens of one declaration, for which any error
+    means the whole source must be checked instead (and the error reported
+    from there.)
+    """
+
+    def error(self, str):
+        raise Reparse(str)
+
+
+def split_declarations(tokens):
+    """Returns the class declarations in the given tokens, as a list of
+    (class name, start, end) triples, or None if the tokens don't start
+    with a declaration (in which case they would not be parsed at all.)
+
+    """
+    if len(tokens) > 0 and tokens[0][0] != "class":
+        return None
+    starts = []
+    depth = 0
+    for (index, (token, toktype, tokval)) in enumerate(tokens):
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth = max(depth - 1, 0)
+        elif token == "class" and depth == 0:
+            starts.append(index)
+    ends = starts[1:] + [len(tokens)]
+    declarations = []
+    for (start, end) in zip(starts, ends):
+        if start + 1 < end:
+            class_name = tokens[start + 1][0]
+        else:
+            class_name = ""
+        declarations.append((class_name, start, end))
+    return declarations
+
+
+def declaration_digests(tokens, declarations):
+    """Returns a map from each class name to a digest of the tokens of all
+    of its declarations.
+
+    """
+    digests = {}
+    for (class_name, start, end) in declarations:
+        digest = digests.setdefault(class_name, hashlib.sha1())
+        text = u"\x00".join([token for (token, toktype, tokval)
+                             in tokens[start:end]])
+        digest.update(text.encode("utf-8") + b"\x01")
+    return dict([(class_name, digest.hexdigest())
+                 for (class_name, digest) in digests.items()])
+
+
+def declaration_positions(declarations):
+    """Returns a map from each class name to the (ascending) indices of
+    its declarations.
+
+    """
+    positions = {}
+    for (index, (class_name, start, end)) in enumerate(declarations):
+        positions.setdefault(class_name, []).append(index)
+    return positions
+
+
+def declaration_context(class_name, references, positions):
+    """Returns, for each class which the named class refers to, how many of
+    the declarations of that class precede each declaration of the named
+    class; that is, how much of it has been declared by then.
+
+    """
+    own = positions[class_name]
+    return tuple([(name, tuple([bisect.bisect_left(positions.get(name, ()),
+                                                   position)
+                                for position in own]))
+                  for name in sorted(references)])
+
+
+def declaration_shape(tokens, start, end):
+    """Returns whether the declaration in the given tokens is plain (it
+    declares no dependants and no modifiers, so it can't change those the
+    class has), and whether it has a body.  A declaration which doesn't
+    look as expected is taken to be neither plain nor bodiless.
+
+    """
+    if (end - start < 6 or tokens[start + 2][0] != "(" or
+        tokens[start + 3][0] != ")" or tokens[start + 4][0] != "extends"):
+        return (False, True)
+    index = start + 6
+    has_body = index < end and tokens[index][0] == "{"
+    if has_body:
+        depth = 0
+        while index < end:
+            token = tokens[index][0]
+            if token == "{":
+                depth += 1
+            elif token == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+            index += 1
+        index += 1
+    return (index == end, has_body)
+
+
+def referred_class_defns(class_defn):
+    """Returns the classes which the given class refers to: its superclass,
+    its dependants, every class it has looked up, and the classes named
+    by, or whose members are used by, its members.
+
+    """
+    class_defns = []
+    if class_defn.superclass is not None:
+        class_defns.append(class_defn.superclass)
+    class_defns.extend(class_defn.dependant_map.values())
+    class_defns.extend(class_defn._class_defn_cache.values())
+    for prop_defn in class_defn.prop_defn_map.values():
+        class_defns.append(prop_defn.type_class_defn)
+    for method_defn in class_defn.method_defn_map.values():
+        for param_decl in method_defn.param_decl_map.values():
+            class_defns.append(param_decl.type_class_defn)
+        exprs = []
+        for assignment in method_defn.assignments:
+            exprs.append(assignment.lhs)
+            exprs.append(assignment.rhs)
+        continue_ = method_defn.continue_
+        if continue_ is not None:
+            class_defns.append(continue_.prop_defn.class_defn)
+            class_defns.append(continue_.prop_defn.type_class_defn)
+            class_defns.append(continue_.target_method_defn.class_defn)
+            exprs.extend(continue_.param_exprs)
+        for expr in exprs:
+            if isinstance(expr, Construction):
+                class_defns.append(expr.type_class_defn)
+                class_defns.extend(expr.dependencies)
+            else:
+                for prop_defn in expr.prop_defns:
+                    class_defns.append(prop_defn.class_defn)
+                    class_defns.append(prop_defn.type_class_defn)
+    return class_defns
+
+
+def observed_class_defns(class_defn, method_defns, has_body):
+    """Returns the classes whose members a declaration of the given class
+    looked up, given the methods it defined and whether it had a body: the
+    superclass (for the members the class inherits), and the classes of
+    the properties that its qualified names and continues go through.
+
+    """
+    class_defns = []
+    if has_body and class_defn.superclass is not None:
+        class_defns.append(class_defn.superclass)
+    for method_defn in method_defns:
+        exprs = []
+        for assignment in method_defn.assignments:
+            exprs.append(assignment.lhs)
+            exprs.append(assignment.rhs)
+        continue_ = method_defn.continue_
+        if continue_ is not None:
+            class_defns.append(continue_.prop_defn.type_class_defn)
+            exprs.extend(continue_.param_exprs)
+        for expr in exprs:
+            if not isinstance(expr, Construction):
+                for prop_defn in expr.prop_defns[:-1]:
+                    class_defns.append(prop_defn.type_class_defn)
+    return class_defns
+
+
+def class_references(class_defn, classbase):
+    """Returns the names of the classes of the given overlay ClassBase
+    (other than itself) which the given class refers to.
+
+    """
+    class_defn_map = classbase.class_defn_map
+    names = set()
+    for other in referred_class_defns(class_defn):
+        if other is not class_defn and \
+           class_defn_map.get(other.name) is other:
+            names.add(other.name)
+    return names
+
+
+def check_kept(index, class_defn, method_defns, has_body, kept, positions,
+               plain):
+    """Raises Reparse unless the declaration of the given class at the
+    given index, just parsed by itself, found every kept class it used as
+    it would have found it while parsing the whole source: declared, with
+    its superclass, dependants and modifiers settled, and, if it looked up
+    its members, with it and its superclasses completely declared.
+
+    """
+    def is_kept(other):
+        return kept.get(other.name) is other
+
+    for other in referred_class_defns(class_defn):
+        if not is_kept(other):
+            continue
+        if positions[other.name][0] > index:
+            raise Reparse(other.name + " is used before it is declared")
+        after = index
+        while other is not None and is_kept(other):
+            for position in positions[other.name]:
+                if position > after and not plain[position]:
+                    raise Reparse(other.name + " is used before it is "
+                                  "settled")
+            after = positions[other.name][0]
+            other = other.superclass
+    for other in observed_class_defns(class_defn, method_defns, has_body):
+        while other is not None and other is not class_defn:
+            if is_kept(other) and positions[other.name][-1] > index:
+                raise Reparse("members of " + other.name + " are used "
+                              "before they are declared")
+            other = other.superclass
+
+
+class DependencyGraph(object):
+    """
+    The classes defined by one source, kept (once the source has been
+    checked without errors) in an overlay on the given parent ClassBase,
+    along with what is needed to check the source again after an edit.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.classbase = None
+        self.digests = {}
+        self.references = {}
+        self.contexts = {}
+        self.checked = []
+
+    def forget(self):
+        self.classbase = None
+        self.digests = {}
+        self.references = {}
+        self.contexts = {}
+        self.checked = []
+
+    def check(self, source):
+        """Checks the given source (anything a Scanner accepts), which
+        replaces the source last checked.  Returns the overlay ClassBase,
+        and whether the source had no errors which were reported (rather
+        than raised.)  checked then lists the names of the classes which
+        were parsed and checked; the others were kept as they were.
+
+        """
+        tokens = scan_tokens(source)
+        declarations = split_declarations(tokens)
+        if self.classbase is not None and declarations is not None:
+            try:
+                return self.recheck(tokens, declarations)
+            except (Reparse, ArtefactExistsError, ArtefactNotFoundError,
+                    BadModifierError, IncompatibleTypeError,
+                    ClassRelationshipError):
+                # checking the whole source again reports any error just
+                # as it would have been reported
+                pass
+        return self.check_all(tokens, declarations)
+
+    def check_all(self, tokens, declarations):
+        self.forget()
+        classbase = ClassBase(self.parent)
+        scanner = TokenScanner(tokens)
+        parser = ClassDefnParser(scanner, classbase)
+        starts = []
+        while scanner.token == "class":
+            starts.append(scanner.position)
+            parser.parse()
+        ok = scanner.errors == 0
+        self.checked = list(classbase.class_names)
+        if (ok and declarations is not None and
+            scanner.position == len(tokens) and
+            starts == [start for (class_name, start, end) in declarations]):
+            self.classbase = classbase
+            self.digests = declaration_digests(tokens, declarations)
+            positions = declaration_positions(declarations)
+            for class_name in classbase.class_names:
+                references = class_references(
+                    classbase.class_defn_map[class_name], classbase)
+                self.references[class_name] = references
+                self.contexts[class_name] = declaration_context(
+                    class_name, references, positions)
+        return (classbase, ok)
+
+    def find_affected(self, changed):
+        """Returns the names of the given classes, and of the classes
+        which refer to them, however indirectly.
+
+        """
+        referrers = {}
+        for (class_name, references) in self.references.items():
+            for name in references:
+                referrers.setdefault(name, []).append(class_name)
+        affected = set(changed)
+        pending = list(changed)
+        while pending:
+            for class_name in referrers.get(pending.pop(), ()):
+                if class_name not in affected:
+                    affected.add(class_name)
+                    pending.append(class_name)
+        return affected
+
+    def recheck(self, tokens, declarations):
+        """Checks the given declarations, parsing only those of the classes
+        affected by the edit.  Raises an exception if that can't be done
+        exactly as checking the whole source would.
+
+        """
+        digests = declaration_digests(tokens, declarations)
+        positions = declaration_positions(declarations)
+        changed = set([class_name for class_name in self.digests
+                       if class_name not in digests])
+        contexts = {}
+        for (class_name, digest) in digests.items():
+            if self.digests.get(class_name) != digest:
+                changed.add(class_name)
+                continue
+            contexts[class_name] = declaration_context(
+                class_name, self.references[class_name], positions)
+            if contexts[class_name] != self.contexts[class_name]:
+                changed.add(class_name)
+        affected = self.find_affected(changed)
+        if 2 * len(affected) > len(self.digests):
+            # keeping the few classes which aren't affected would cost
+            # more than it saves
+            raise Reparse("most classes are affected")
+
+        classbase = self.classbase
+        references = self.references
+        self.forget()
+        kept = {}
+        for (class_name, class_defn) in classbase.class_defn_map.items():
+            if class_name not in affected:
+                kept[class_name] = class_defn
+        for class_defn in kept.values():
+            class_defn.subclass_defns = [
+                subclass_defn for subclass_defn in class_defn.subclass_defns
+                if subclass_defn.name in kept
+            ]
+        classbase.class_defn_map = {}
+        classbase.class_names = []
+        checked = []
+        shapes = [declaration_shape(tokens, start, end)
+                  for (class_name, start, end) in declarations]
+        plain = [is_plain for (is_plain, has_body) in shapes]
+        for (index, (class_name, start, end)) in enumerate(declarations):
+            if class_name in kept:
+                if class_name not in classbase.class_defn_map:
+                    classbase.class_defn_map[class_name] = kept[class_name]
+                    classbase.class_names.append(class_name)
+                continue
+            class_defn = classbase.class_defn_map.get(class_name)
+            if class_defn is None:
+                defined = set()
+            else:
+                defined = set(class_defn.method_defn_map)
+            scanner = FragmentScanner(tokens[start:end])
+            ClassDefnParser(scanner, classbase).parse()
+            if scanner.position != end - start:
+                raise Reparse("declaration of " + class_name +
+                              " does not end where expected")
+            class_defn = classbase.class_defn_map[class_name]
+            method_defns = [method_defn for (method_name, method_defn)
+                            in class_defn.method_defn_map.items()
+                            if method_name not in defined]
+            check_kept(index, class_defn, method_defns, shapes[index][1],
+                       kept, positions, plain)
+            if class_name not in checked:
+                checked.append(class_name)
+
+        references = dict([(class_name, references[class_name])
+                           for class_name in kept])
+        for class_name in checked:
+            references[class_name] = class_references(
+                classbase.class_defn_map[class_name], classbase)
+            contexts[class_name] = declaration_context(
+                class_name, references[class_name], positions)
+        self.classbase = classbase
+        self.digests = digests
+        self.references = references
+        self.contexts = contexts
+        self.checked = checked
+        return (classbase, True)
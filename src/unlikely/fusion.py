@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Continuation-chain fusion for the Unlikely programming language.
+
+Idiomatic Unlikely code builds a chain of built-in continuations in
+properties of the current instance -- a Print whose next is an Add whose
+next is something else -- and then immediately continues the head of it.
+When nothing else in the program ever looks at those properties, the
+chain can instead be run in the same step as the method which built it,
+by applying each link to the accumulator in turn, so that none of the
+links need be constructed at all.
+
+This module only finds such chains; the compiler builds the fused
+closures (see compiler.py).
+"""
+
+from .ast import Construction
+
+
+class Link(object):
+    """
+    One link of a fusable chain: a property of the current instance which
+    is assigned a new instance of a built-in class, and then has the
+    properties of that instance assigned.
+    """
+
+    def __init__(self, prop_defn, construction, construction_index):
+        self.prop_defn = prop_defn
+        self.construction = construction
+        self.construction_index = construction_index
+        self.class_defn = construction.type_class_defn
+        self.fields = {}
+
+
+class Chain(object):
+    """
+    A fusable chain, found in a method definition.  links lists the
+    links in the order they are continued; next_expr is the expression
+    whose value is continued after the last of them; skipped is the set
+    of indices of the assignments which built the chain.
+    """
+
+    def __init__(self, links, next_expr, skipped):
+        self.links = links
+        self.next_expr = next_expr
+        self.skipped = skipped
+
+
+def count_uses(method_defn, uses):
+    """Adds to the counts, in the given dict, of the places where a
+    property is read, has its own properties assigned, or is continued.
+
+    """
+    for assignment in method_defn.assignments:
+        for prop_defn in assignment.lhs.prop_defns[:-1]:
+            uses[prop_defn] = uses.get(prop_defn, 0) + 1
+        count_expr_uses(assignment.rhs, uses)
+    continue_ = method_defn.continue_
+    uses[continue_.prop_defn] = uses.get(continue_.prop_defn, 0) + 1
+    for param_expr in continue_.param_exprs:
+        count_expr_uses(param_expr, uses)
+
+
+def count_expr_uses(expr, uses):
+    if isinstance(expr, Construction):
+        return
+    for prop_defn in expr.prop_defns:
+        uses[prop_defn] = uses.get(prop_defn, 0) + 1
+
+
+def find_chain(method_defn, uses, fields):
+    """Returns the fusable Chain which the given method continues, or None
+    if it does not continue one.
+
+    uses is as counted by count_uses over the whole program; fields maps
+    each built-in class that can be fused to the names of the properties
+    (other than next) which it reads.  A chain stops at the first link
+    which isn't fusable, which is then simply continued.
+
+    """
+    continue_ = method_defn.continue_
+    if (continue_.method_name != "continue" or
+        len(continue_.param_exprs) != 1):
+        return None
+    assignments = method_defn.assignments
+    links = []
+    skipped = set()
+    prop_defn = continue_.prop_defn
+    consumed_at = len(assignments)
+    while True:
+        link = find_link(assignments, prop_defn, uses, fields, consumed_at)
+        if link is None:
+            break
+        links.append(link)
+        skipped.update([index for (index, expr) in link.fields.values()])
+        skipped.add(link.construction_index)
+        (consumed_at, next_expr) = link.fields["next"]
+        if isinstance(next_expr, Construction) or \
+           len(next_expr.prop_defns) != 1:
+            break
+        prop_defn = next_expr.prop_defns[0]
+    if len(links) == 0:
+        return None
+    for link in links:
+        for (index, expr) in link.fields.values():
+            if not is_deferrable(assignments, index, expr):
+                return None
+    return Chain(links, next_expr, skipped)
+
+
+def find_link(assignments, prop_defn, uses, fields, consumed_at):
+    """Returns the Link for the given property, if it is assigned exactly
+    once, before consumed_at (where its value is read), to a new instance
+    of a fusable class; all the properties of that instance which the class
+    reads are then assigned exactly once; and the property is used nowhere
+    else in the program (it is read, or continued, exactly once.)
+
+    """
+    link = None
+    for (index, assignment) in enumerate(assignments):
+        lhs = assignment.lhs.prop_defns
+        if lhs[0] is not prop_defn:
+            continue
+        if len(lhs) == 1:
+            if link is not None or not isinstance(assignment.rhs,
+                                                  Construction):
+                return None
+            link = Link(prop_defn, assignment.rhs, index)
+            if link.class_defn not in fields or index > consumed_at:
+                return None
+        elif link is None or len(lhs) != 2:
+            return None
+        else:
+            name = lhs[1].name
+            if name in link.fields:
+                return None
+            link.fields[name] = (index, assignment.rhs)
+    if link is None:
+        return None
+    names = set(fields[link.class_defn])
+    names.add("next")
+    if set(link.fields.keys()) != names:
+        return None
+    if uses.get(prop_defn, 0) != 1 + len(link.fields):
+        return None
+    return link
+
+
+def is_deferrable(assignments, index, expr):
+    """Returns True if evaluating the given expression, the right-hand side
+    of the assignment at the given index, after all the assignments would
+    give the same value.
+
+    """
+    if isinstance(expr, Construction):
+        return True
+    for assignment in assignments[index + 1:]:
+        if assignment.lhs.prop_defns[-1] in expr.prop_defns:
+            return False
+    return True
@@ -1,55 +1,402 @@
 # -*- coding: utf-8 -*-
 
 """
-Interpreter for the Unlikely programming language.  XXX incomplete!
+Interpreter for the Unlikely programming language.
 $Id: interpreter.py 509 2010-04-27 20:15:32Z cpressey $
+
+Since no Unlikely method ever returns, a method is executed by performing
+its assignments and then handing back the continuation it names, and the
+interpreter simply keeps executing continuations in a loop (a trampoline.)
+The Python stack therefore never grows, however long the program runs,
+and nothing but the continuations still reachable from the current one is
+kept alive, so that those which are not are freed as soon as the program
+moves on (unless they are part of a cycle, which is left to the cyclic
+garbage collector.)  Methods are compiled into closures (see
+compiler.py) before they are run, or else assembled into bytecode, which
+a VM runs (see bytecode.py.)  Given a Profile (see profiler.py), the
+interpreter counts what the program does, and times the built-in methods.
+With the JIT enabled, the trampoline is run by a Tracer (see jit.py),
+which compiles the cycles the program continues most often into Python
+functions of their own.
+
+What a program prints is collected in an OutputBuffer, and written out
+in one go when enough has been collected, when the program stops or is
+stopped, and before it reads any input.  An interpreter can also be made
+to suspend the program when it continues an Input and no line of input
+has been given to it yet, instead of reading one; it can then be resumed
+once there is one (see aio.py), as it can be after it has run for so many
+continuations (see scheduler.py), or after it has been saved, and read
+back, in a checkpoint (see checkpoint.py.)
 """
 
-import ast
+import gc
+from collections import deque
+import operator
+import sys
+import time
+
+from .ast import ClassRelationshipError
+from .bytecode import VM
+from .compiler import Compiler
+from .jit import Tracer
+from .runtime import Instance, box, unbox, container_at
+from . import stdlib
+
+
+clock = getattr(time, "perf_counter", time.time)
+
+# How much output (in characters) is collected before it is written out.
+BUFFER_SIZE = 65536
+
+# Slot indices of the properties of the built-in classes.
+ACCUMULATOR = stdlib.accumulator.get_slot_index()
+NEXT = stdlib.chain.lookup_prop_defn("next").get_slot_index()
+ELSE = stdlib.branch.lookup_prop_defn("else").get_slot_index()
+STATE = stdlib.switch.lookup_prop_defn("state").get_slot_index()
+TEST = stdlib.while_loop.lookup_prop_defn("test").get_slot_index()
+FOR_VALUE = stdlib.for_loop.lookup_prop_defn("value").get_slot_index()
+DELTA = stdlib.for_loop.lookup_prop_defn("delta").get_slot_index()
+FINISH = stdlib.for_loop.lookup_prop_defn("finish").get_slot_index()
+
+
+def freeze_heap():
+    """Moves everything allocated so far, such as the loaded AST and the
+    closures compiled from it, out of the view of the cyclic garbage
+    collector, so that it only ever has to look through what the program
+    allocates while it runs (which usually dies young.)  Call this once
+    the program has been loaded; it does nothing before Python 3.7.
+
+    """
+    if hasattr(gc, "freeze"):
+        gc.collect()
+        gc.freeze()
+
+
+def binary_intrinsic(op):
+    """Returns the intrinsic of a BinaryOperation, which applies op to its
+    value and the accumulator, in that order.
+
+    """
+    def intrinsic(accumulator, value):
+        return op(unbox(value), unbox(accumulator))
+    return intrinsic
+
+
+def parse_input(line):
+    """Returns the value of a line of input: an Integer, if it is all
+    digits, and otherwise a String.
+
+    """
+    line = line.rstrip("\r\n")
+    if line.isdigit():
+        return int(line)
+    return line
+
+
+class OutputBuffer(object):
+    """
+    Collects what is written to it, and writes it to the given stream in
+    one go once size characters have been collected, or when flushed.
+    """
+
+    def __init__(self, stream, size=BUFFER_SIZE):
+        self.stream = stream
+        self.size = size
+        self.chunks = []
+        self.pending = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.pending += len(data)
+        if self.pending >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write("".join(self.chunks))
+            self.chunks = []
+            self.pending = 0
+        self.stream.flush()
+
 
-class Instance(object):
+class Interpreter(object):
     """
-    Represents an instance of an Unlikely class, at runtime.
+    Runs Unlikely programs.
     """
-    
-    def __init__(self, class_defn):
-        self.class_defn = class_defn
-        self.props = {}
-
-    def set(self, prop_name, value):
-        self.props[prop_name] = value
-
-    def get(self, prop_name):
-        return self.props[prop_name]
-
-    def execute(self, method_name, args):
-        """
-        Executes a method name in this instance.
-        Returns a new instance and method name to be executed next.
-        """
-        for arg in args:
-            self.set(arg, args[arg])
-        method_defn = self.class_defn.lookup_method_defn(method_name)
-        for assignment in method_defn.assignments:
-            self.assign(assignment.lhs, assignment.rhs)
-        # apply args in method_defn.continue_
-        # get instance from method_defn.continue_
-        # get method name from method_defn.continue_
-        return (instance, method_name)
-
-    def assign(self, lhs, rhs):
-        (instance, prop_name) = self.resolve_qual_name(lhs)
-        if isinstance(rhs, Construction):
-            value = self.eval_construction(rhs)
-        else:
-            (src_instance, src_prop_name) = self.resolve_qual_name(rhs)
-            value = src_instance.get(src_prop_name)
-        instance.set(prop_name, value)
-
-    def resolve_qual_name(self, qual_name, pos = 0):
-        prop_defn = qual_name.get_prop_defn_by_index(pos)
-        prop_name = prop_defn.name
-        if pos == qual_name.length():
-            return (self, prop_name)
-        instance = self.get(prop_name)
-        return instance.resolve_qual_name(qual_name, pos + 1)
+
+    def __init__(self, stdout=None, stdin=None, profile=None, jit=False,
+                 buffer_size=BUFFER_SIZE, suspend_input=False):
+        """What the program prints goes to stdout, through an OutputBuffer
+        of the given size, unless it is 0.  Given suspend_input, an Input
+        with no line in lines to read suspends the program instead of
+        reading from stdin.
+
+        """
+        self.stdout = stdout or sys.stdout
+        if buffer_size > 0:
+            self.stdout = OutputBuffer(self.stdout, buffer_size)
+        self.stdin = stdin or sys.stdin
+        self.lines = deque()
+        self.suspend_input = suspend_input
+        self.waiting = False
+        self.suspended = None
+        self.continuations = 0
+        self.elapsed = 0.0
+        self.intrinsics = {
+            stdlib.add: (("value",), binary_intrinsic(operator.add)),
+            stdlib.subtract: (("value",), binary_intrinsic(operator.sub)),
+            stdlib.multiply: (("value",), binary_intrinsic(operator.mul)),
+            stdlib.divide: (("value",), binary_intrinsic(operator.floordiv)),
+            stdlib.equal: (("value",), binary_intrinsic(operator.eq)),
+            stdlib.greater_than: (("value",), binary_intrinsic(operator.gt)),
+            stdlib.print_: ((), self.intrinsic_print),
+            stdlib.input_: ((), self.intrinsic_input),
+        }
+        self.natives = {
+            stdlib.stop: self.native_stop,
+            stdlib.passive: self.native_passive,
+            stdlib.if_: self.native_if,
+            stdlib.while_loop: self.native_while_loop,
+            stdlib.for_loop: self.native_for_loop,
+        }
+        if suspend_input:
+            # an Input must be continued by the trampoline, so that it can
+            # stop there, so it is not fused
+            del self.intrinsics[stdlib.input_]
+            self.natives[stdlib.input_] = self.native_input
+        if profile is not None:
+            for (class_defn, native) in self.natives.items():
+                self.natives[class_defn] = \
+                  profile.time_native(class_defn.name, native)
+            for (class_defn, (names, intrinsic)) in self.intrinsics.items():
+                self.intrinsics[class_defn] = \
+                  (names, profile.time_native(class_defn.name, intrinsic))
+        for (class_defn, (names, intrinsic)) in self.intrinsics.items():
+            self.natives[class_defn] = self.chain_native(class_defn, names,
+                                                         intrinsic)
+        self.compiler = Compiler(self.natives, self.intrinsics, profile)
+        self.result = None
+        self.tracer = None
+        if jit:
+            if profile is not None:
+                raise ValueError("cannot profile a program run with the JIT")
+            self.tracer = Tracer(self)
+
+    def load(self, classbase):
+        """Compiles every method defined in the given ClassBase, so that
+        running it later only dispatches to prebuilt closures.
+
+        """
+        self.compiler.compile_class_base(classbase)
+
+    def load_bytecode(self, bytecode):
+        """Installs the methods in the given Bytecode (see bytecode.py), so
+        that a VM runs them in place of the closures they would otherwise
+        have been compiled into.  (Those which continue a fusable chain are
+        still fused, falling back to the VM.)
+
+        """
+        vm = VM(bytecode, self.compiler)
+        method_defns = bytecode.method_defns()
+        self.compiler.compile_method_defns(
+            [method_defn for (method_defn, offset) in method_defns],
+            dict([(method_defn, vm.method(offset))
+                  for (method_defn, offset) in method_defns]))
+
+    def instantiate_program(self, class_defn, accumulator=None):
+        """Creates an instance of the given Program class, as the operating
+        system would, injecting each of its dependant classes as itself.
+
+        """
+        if not class_defn.is_subclass_of(stdlib.program):
+            raise ClassRelationshipError(class_defn.name +
+                                         " is not a Program")
+        if class_defn.has_modifier("abstract"):
+            raise ClassRelationshipError("cannot instantiate abstract " +
+                                         class_defn.name)
+        injections = {}
+        for dependant_name in class_defn.dependant_names:
+            injections[dependant_name] = \
+              class_defn.dependant_map[dependant_name]
+        instance = Instance(class_defn, injections)
+        if accumulator is None:
+            accumulator = 0
+        instance.set("accumulator", accumulator)
+        return instance
+
+    def run(self, class_defn, accumulator=None, max_steps=None):
+        """Runs the given Program class to completion, or until max_steps
+        continuations have been executed.  Returns the value passed to
+        Stop, or None if the program did not stop.  (The instance of the
+        program is not kept here, so that it, and whatever it refers to,
+        can be freed as soon as it has been continued.)  With the JIT
+        enabled, it is run by the Tracer's trampoline instead.
+
+        """
+        self.start(class_defn, accumulator)
+        try:
+            return self.resume(max_steps)
+        finally:
+            self.stdout.flush()
+
+    def start(self, class_defn, accumulator=None):
+        """Creates an instance of the given Program class, and leaves it in
+        suspended, to be continued when the program is resumed.
+
+        """
+        self.suspended = (self.instantiate_program(class_defn, accumulator),
+                          "continue")
+
+    def resume(self, max_steps=None):
+        """Runs the suspended program until it stops, or until it is
+        suspended again: after max_steps more continuations, or (given
+        suspend_input) at an Input with no line to read, which is left
+        waiting, and not counted as continued.  Returns what run does.
+        (The trampoline takes the program out of suspended itself, so that
+        no frame but its own refers to the continuation it started from.)
+
+        """
+        self.waiting = False
+        result = self.select_trampoline()(None, None, max_steps)
+        if self.waiting:
+            self.continuations -= 1
+        return result
+
+    def select_trampoline(self):
+        """Returns the trampoline to run the program with: the Tracer's,
+        with the JIT enabled, and otherwise the interpreter's own.
+
+        """
+        if self.tracer is not None:
+            return self.tracer.trampoline
+        return self.trampoline
+
+    def trampoline(self, instance, method_name, max_steps=None):
+        """Runs continuations, starting with the given one (or, if it is
+        None, the suspended one), until the program stops or max_steps
+        continuations have been executed.  A fused chain counts as every
+        continuation in it, and is not run fused if it would overrun
+        max_steps.  Having run max_steps, it leaves the continuation it
+        stopped at in suspended.
+
+        """
+        if instance is None:
+            (instance, method_name) = self.suspended
+            self.suspended = None
+        self.result = None
+        dispatch = self.compiler.dispatch
+        lookup = self.compiler.lookup
+        fused = self.compiler.fused
+        steps = 0
+        start = clock()
+        try:
+            while max_steps is None or steps < max_steps:
+                try:
+                    method = dispatch[instance.class_defn][method_name]
+                except (KeyError, AttributeError):
+                    if not isinstance(instance, Instance):
+                        instance = box(instance)
+                    method = lookup(instance.class_defn, method_name)
+                if method in fused:
+                    (length, plain, guard, links) = fused[method]
+                    if not guard(instance.injections) or \
+                       (max_steps is not None and steps + length > max_steps):
+                        method = plain
+                        length = 1
+                    steps += length
+                else:
+                    steps += 1
+                next_ = method(instance)
+                if next_ is None:
+                    break
+                (instance, method_name) = next_
+            else:
+                self.suspended = (instance, method_name)
+        finally:
+            self.continuations += steps
+            self.elapsed += clock() - start
+        return self.result
+
+    def rate(self):
+        """Returns the throughput so far, in continuations per second."""
+        if self.elapsed == 0.0:
+            return 0.0
+        return self.continuations / self.elapsed
+
+    # The built-in classes.  Passive values in the accumulator and in the
+    # properties of these are expected to be unboxed, but are unboxed
+    # anyway when they are not.
+
+    def continue_next(self, instance, index, accumulator):
+        next_ = container_at(instance, index)
+        next_.slots[ACCUMULATOR] = accumulator
+        return (next_, "continue")
+
+    def native_stop(self, instance):
+        self.result = unbox(instance.get_slot(ACCUMULATOR))
+        self.stdout.flush()
+        return None
+
+    def native_passive(self, instance):
+        return self.continue_next(instance, NEXT, instance.value)
+
+    def chain_native(self, class_defn, names, intrinsic):
+        """Returns the native method of a built-in Chain class, given the
+        properties it reads and its intrinsic (see Compiler.)
+
+        """
+        indices = tuple([class_defn.lookup_prop_defn(name).get_slot_index()
+                         for name in names])
+        continue_next = self.continue_next
+
+        def native(instance):
+            values = [instance.get_slot(index) for index in indices]
+            accumulator = intrinsic(instance.get_slot(ACCUMULATOR), *values)
+            return continue_next(instance, NEXT, accumulator)
+        return native
+
+    def intrinsic_print(self, accumulator):
+        self.stdout.write(str(accumulator) + "\n")
+        return accumulator
+
+    def intrinsic_input(self, accumulator):
+        self.stdout.flush()
+        return parse_input(self.stdin.readline())
+
+    def native_input(self, instance):
+        """The native method of Input, when the interpreter suspends the
+        program for input: if there is no line in lines, it leaves the
+        Input in suspended, sets waiting, and stops the program.
+
+        """
+        if not self.lines:
+            self.stdout.flush()
+            self.suspended = (instance, "continue")
+            self.waiting = True
+            return None
+        return self.continue_next(instance, NEXT,
+                                  parse_input(self.lines.popleft()))
+
+    def native_if(self, instance):
+        accumulator = instance.get_slot(ACCUMULATOR)
+        if unbox(accumulator) is True:
+            return self.continue_next(instance, NEXT, accumulator)
+        return self.continue_next(instance, ELSE, accumulator)
+
+    def native_while_loop(self, instance):
+        """On odd visits, continues test; on even visits, behaves like If."""
+        if unbox(instance.slots[STATE]) is not True:
+            instance.slots[STATE] = True
+            return self.continue_next(instance, TEST,
+                                      instance.get_slot(ACCUMULATOR))
+        instance.slots[STATE] = False
+        return self.native_if(instance)
+
+    def native_for_loop(self, instance):
+        accumulator = instance.get_slot(ACCUMULATOR)
+        value = unbox(instance.get_slot(FOR_VALUE))
+        if value == unbox(instance.get_slot(FINISH)):
+            return self.continue_next(instance, ELSE, accumulator)
+        delta = unbox(instance.get_slot(DELTA))
+        instance.slots[FOR_VALUE] = value + delta
+        return self.continue_next(instance, NEXT, accumulator)
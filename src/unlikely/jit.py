@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Tracing JIT compiler for the Unlikely programming language.
+
+An Unlikely program which runs for long does so by continuing the same
+cycle of methods, on instances of the same classes, over and over.  The
+Tracer runs the trampoline itself, counting how often each method is
+continued; once one has been continued often enough, it records the
+continuations which follow it, until the same method is continued on an
+instance of the same class again.  That cycle (a trace) is then written
+out as the source of a Python function, which is compiled and run in
+place of the trampoline whenever the program gets back to the start of
+it.
+
+The function runs the cycle in a loop, for as many whole laps as the
+program may still take steps.  Each method compiled from the AST is
+written out inline, with its slot indices as constants, and so is each
+fused chain (see fusion.py), calling the intrinsics of its links one
+after another; built-in methods are called as they are by the
+trampoline.  Before each continuation the function checks that it is of
+the same method, on an instance of the very class that was recorded (and
+that a chain which was, or was not, run fused when it was recorded, would
+be again); where one isn't, it leaves the loop and hands that
+continuation back to the trampoline.  Since the classes of what a method
+constructs depend only on those injected into its instance, and those it
+was constructed with, these checks cover what was injected along the
+cycle too.
+
+Continuations are counted just as the trampoline would count them, so a
+program stopped after some number of continuations stops at the same
+place whether or not any of it was traced.
+"""
+
+import sys
+import time
+
+from .ast import Construction
+from .compiler import slot_indices
+from .fusion import find_chain
+from .runtime import Instance, unassigned, container_at, box, \
+                     value_of_class_defn
+
+
+clock = getattr(time, "perf_counter", time.time)
+
+# How often a method must be continued before a trace is recorded from it.
+HOT = 100
+
+# The most continuations a trace may have; one that runs longer without
+# getting back to where it started is abandoned.
+MAX_TRACE_LENGTH = 50
+
+# How often a trace may be left before it has run a whole lap, before it
+# is given up on.
+MAX_FAILURES = 100
+
+
+class Step(object):
+    """
+    One continuation in a trace: of the named method, on an instance of
+    the given class.  kind is "inline" for a method compiled from the AST
+    (method_defn), "fused" for one compiled into a fused chain (and run
+    fused), or "native" for a built-in method (method); length is the
+    number of continuations it counts as.  guard, if given, is that of the
+    fused chain the method compiles to (see Compiler.compile_chain), which
+    must pass for a fused step, and fail for an inline one.
+    """
+
+    def __init__(self, class_defn, method_name, kind, length, method=None,
+                 method_defn=None, guard=None):
+        self.class_defn = class_defn
+        self.method_name = method_name
+        self.kind = kind
+        self.length = length
+        self.method = method
+        self.method_defn = method_defn
+        self.guard = guard
+
+
+class TraceWriter(object):
+    """
+    Writes out the source of the function which runs a trace, and builds
+    it.  The objects the source refers to (classes, closures and
+    constants) are passed to a factory function, so that the trace
+    refers to them as free variables.
+    """
+
+    def __init__(self, compiler):
+        self.compiler = compiler
+        self.lines = []
+        self.names = []
+        self.values = []
+        self.temps = 0
+
+    def constant(self, value):
+        for (index, known) in enumerate(self.values):
+            if known is value:
+                return self.names[index]
+        name = "k%d" % len(self.values)
+        self.names.append(name)
+        self.values.append(value)
+        return name
+
+    def temp(self):
+        self.temps += 1
+        return "t%d" % self.temps
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def write(self, steps):
+        """Returns the function which runs the given steps, in a loop, and
+        two cells, entry and done.  The function takes the most
+        continuations it may count, and returns the next continuation to
+        be run (or None, if the program stopped.)  The instance to start
+        from (on which steps[0] is to be continued) is passed to it in
+        entry[0], which it clears, so that the caller need not keep the
+        instance (and every one continued after it) alive while it runs.
+        It counts the continuations it ran in done[0].
+
+        """
+        lap = sum([step.length for step in steps])
+        entry = [None]
+        done = [0]
+        self.emit(0, "def trace(limit):")
+        self.emit(1, "instance = %s[0]" % self.constant(entry))
+        self.emit(1, "%s[0] = None" % self.constant(entry))
+        self.emit(1, "steps = 0")
+        self.emit(1, "try:")
+        self.emit(2, "while steps + %d <= limit:" % lap)
+        for (index, step) in enumerate(steps):
+            self.write_step(3, step)
+            if index + 1 < len(steps):
+                next_name = steps[index + 1].method_name
+            else:
+                next_name = steps[0].method_name
+            if step.kind == "native":
+                self.emit(3, "if method_name != %r:" % next_name)
+                self.emit(4, "return (instance, method_name)")
+        self.emit(2, "return (instance, %r)" % steps[0].method_name)
+        self.emit(1, "finally:")
+        self.emit(2, "%s[0] = steps" % self.constant(done))
+        self.emit(0, "return trace")
+        source = ("def factory(%s):\n" % ", ".join(self.names) +
+                  "\n".join(["    " + line for line in self.lines]) + "\n")
+        namespace = {"Instance": Instance, "unassigned": unassigned,
+                     "container_at": container_at, "box": box}
+        eval(compile(source, "<trace>", "exec"), namespace)
+        return (namespace["factory"](*self.values), entry, done)
+
+    def write_step(self, indent, step):
+        self.emit(indent, "# %s.%s" % (step.class_defn.name,
+                                       step.method_name))
+        self.emit(indent, "if type(instance) is not Instance:")
+        self.emit(indent + 1, "instance = box(instance)")
+        self.emit(indent, "if instance.class_defn is not %s:" %
+                  self.constant(step.class_defn))
+        self.emit(indent + 1, "return (instance, %r)" % step.method_name)
+        if step.guard is not None:
+            self.emit(indent, "if %s%s(instance.injections):" %
+                      ("not " if step.kind == "fused" else "",
+                       self.constant(step.guard)))
+            self.emit(indent + 1, "return (instance, %r)" %
+                      step.method_name)
+        self.emit(indent, "steps += %d" % step.length)
+        if step.kind == "inline":
+            self.write_method_defn(indent, step.method_defn)
+        elif step.kind == "fused":
+            self.write_chain(indent, step.method_defn)
+        else:
+            next_ = self.temp()
+            self.emit(indent, "%s = %s(instance)" %
+                      (next_, self.constant(step.method)))
+            self.emit(indent, "if %s is None:" % next_)
+            self.emit(indent + 1, "return None")
+            self.emit(indent, "(instance, method_name) = %s" % next_)
+
+    def write_method_defn(self, indent, method_defn):
+        """Writes out the given method, as the compiler would have compiled
+        it (see Compiler.compile_method_defn), leaving the instance it
+        continues in instance.
+
+        """
+        boxed = self.compiler.boxed
+        for assignment in method_defn.assignments:
+            self.write_assignment(indent, assignment)
+        continue_ = method_defn.continue_
+        target_method_defn = continue_.target_method_defn
+        param_prop_defns = [target_method_defn.lookup_prop_defn(param_name)
+                            for param_name in target_method_defn.param_names]
+        values = [self.write_expr(indent, param_expr, prop_defn in boxed)
+                  for (param_expr, prop_defn)
+                  in zip(continue_.param_exprs, param_prop_defns)]
+        target = self.write_container(
+            indent, (continue_.prop_defn.get_slot_index(),))
+        for (prop_defn, value) in zip(param_prop_defns, values):
+            self.emit(indent, "%s.slots[%d] = %s" %
+                      (target, prop_defn.get_slot_index(), value))
+        self.emit(indent, "instance = %s" % target)
+
+    def write_chain(self, indent, method_defn):
+        """Writes out the given method, which continues a fusable chain, as
+        the compiler would have compiled it (see Compiler.compile_chain.)
+
+        """
+        chain = find_chain(method_defn, self.compiler.uses,
+                           self.compiler.fusable)
+        for (index, assignment) in enumerate(method_defn.assignments):
+            if index not in chain.skipped:
+                self.write_assignment(indent, assignment)
+        continue_ = method_defn.continue_
+        fields = [chain.links[-1].fields["next"]]
+        for link in chain.links:
+            fields.extend([field for (name, field) in link.fields.items()
+                           if name != "next"])
+        fields.sort(key=lambda field: field[0])
+        next_index = chain.links[-1].fields["next"][0]
+        values = dict([(index, self.write_expr(indent, expr,
+                                               index == next_index))
+                       for (index, expr) in fields])
+        accumulator = self.write_expr(indent, continue_.param_exprs[0])
+        for link in chain.links:
+            (names, function) = self.compiler.intrinsics[link.class_defn]
+            result = self.temp()
+            self.emit(indent, "%s = %s(%s)" % (
+                result, self.constant(function),
+                ", ".join([accumulator] + [values[link.fields[name][0]]
+                                           for name in names])))
+            accumulator = result
+        target_method_defn = continue_.target_method_defn
+        accumulator_index = target_method_defn.lookup_prop_defn(
+            target_method_defn.param_names[0]).get_slot_index()
+        next_ = values[next_index]
+        self.emit(indent, "instance = %s" % next_)
+        self.emit(indent, "if type(instance) is not Instance:")
+        self.emit(indent + 1, "instance = box(instance)")
+        self.emit(indent, "instance.slots[%d] = %s" %
+                  (accumulator_index, accumulator))
+
+    def write_assignment(self, indent, assignment):
+        lhs = assignment.lhs.prop_defns[-1]
+        value = self.write_expr(indent, assignment.rhs,
+                                lhs in self.compiler.boxed)
+        indices = slot_indices(assignment.lhs)
+        target = "instance"
+        if len(indices) > 1:
+            target = self.write_container(indent, indices[:-1])
+        self.emit(indent, "%s.slots[%d] = %s" %
+                  (target, indices[-1], value))
+
+    def write_expr(self, indent, expr, boxed=False):
+        """Writes out the evaluation of the given expression, and returns
+        the name of the variable (or constant) holding its value.
+
+        """
+        if isinstance(expr, Construction):
+            class_defn = expr.type_class_defn
+            value = value_of_class_defn(class_defn)
+            if (value is not None and not class_defn.must_be_injected() and
+                not boxed):
+                return self.constant(value)
+            construct = self.compiler.compile_construction(expr, boxed)
+            result = self.temp()
+            self.emit(indent, "%s = %s(instance)" %
+                      (result, self.constant(construct)))
+            return result
+        indices = slot_indices(expr)
+        if expr.prop_defns[-1] in self.compiler.boxed:
+            return self.write_container(indent, indices)
+        source = self.write_container(indent, indices[:-1])
+        result = self.temp()
+        self.emit(indent, "%s = %s.slots[%d]" % (result, source, indices[-1]))
+        self.emit(indent, "if %s is None:" % result)
+        self.emit(indent + 1, "raise unassigned(%s, %d)" %
+                  (source, indices[-1]))
+        return result
+
+    def write_container(self, indent, indices):
+        source = "instance"
+        for index in indices:
+            result = self.temp()
+            self.emit(indent, "%s = container_at(%s, %d)" %
+                      (result, source, index))
+            source = result
+        return source
+
+
+class Tracer(object):
+    """
+    Runs the trampoline of an Interpreter, recording and compiling traces
+    of the cycles it continues most often.
+    """
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.compiler = interpreter.compiler
+        self.hits = {}
+        self.traces = {}
+        self.failures = {}
+        self.abandoned = set()
+
+    def start_trace(self, class_defn, method_name):
+        """Returns whether a trace should be recorded from the given
+        continuation.
+
+        """
+        key = (class_defn, method_name)
+        return (key not in self.abandoned and
+                method_name not in self.traces.get(class_defn, {}))
+
+    def record_step(self, class_defn, method_name, method, length):
+        """Returns the Step for the given continuation, which was run as
+        the given closure, counting as length continuations.
+
+        """
+        guard = None
+        dispatched = self.compiler.lookup(class_defn, method_name)
+        if dispatched in self.compiler.fused:
+            guard = self.compiler.fused[dispatched][2]
+        method_defn = class_defn.lookup_method_defn(method_name)
+        if length > 1:
+            return Step(class_defn, method_name, "fused", length,
+                        method_defn=method_defn, guard=guard)
+        if method_defn.continue_ is not None:
+            return Step(class_defn, method_name, "inline", 1,
+                        method_defn=method_defn, guard=guard)
+        return Step(class_defn, method_name, "native", 1, method=method)
+
+    def finish_trace(self, steps):
+        (trace, entry, done) = TraceWriter(self.compiler).write(steps)
+        lap = sum([step.length for step in steps])
+        self.traces.setdefault(steps[0].class_defn, {})[
+            steps[0].method_name] = (trace, entry, done, lap)
+
+    def fail(self, class_defn, method_name):
+        """Notes that the trace from the given continuation was left before
+        it ran a whole lap, and gives up on it if that happens too often.
+
+        """
+        key = (class_defn, method_name)
+        failures = self.failures.get(key, 0) + 1
+        self.failures[key] = failures
+        if failures > MAX_FAILURES:
+            del self.traces[class_defn][method_name]
+            self.abandoned.add(key)
+
+    def trampoline(self, instance, method_name, max_steps=None):
+        """Runs continuations, as Interpreter.trampoline does, running
+        traces instead wherever there is one.
+
+        """
+        interpreter = self.interpreter
+        if instance is None:
+            (instance, method_name) = interpreter.suspended
+            interpreter.suspended = None
+        interpreter.result = None
+        dispatch = self.compiler.dispatch
+        lookup = self.compiler.lookup
+        fused = self.compiler.fused
+        traces = self.traces
+        hits = self.hits
+        recording = None
+        steps = 0
+        start = clock()
+        try:
+            while max_steps is None or steps < max_steps:
+                if type(instance) is not Instance:
+                    instance = box(instance)
+                class_defn = instance.class_defn
+                traced = traces.get(class_defn)
+                if traced is not None and method_name in traced:
+                    recording = None
+                    (trace, entry, done, lap) = traced[method_name]
+                    if max_steps is None:
+                        limit = sys.maxsize
+                    else:
+                        limit = max_steps - steps
+                    entry[0] = instance
+                    instance = next_ = None
+                    try:
+                        next_ = trace(limit)
+                    finally:
+                        steps += done[0]
+                    if done[0] < lap and limit >= lap:
+                        self.fail(class_defn, method_name)
+                    if next_ is None:
+                        break
+                    (instance, method_name) = next_
+                    if done[0] > 0:
+                        continue
+                try:
+                    method = dispatch[class_defn][method_name]
+                except KeyError:
+                    method = lookup(class_defn, method_name)
+                length = 1
+                if method in fused:
+                    (length, plain, guard, links) = fused[method]
+                    if not guard(instance.injections) or \
+                       (max_steps is not None and steps + length > max_steps):
+                        method = plain
+                        length = 1
+                if recording is not None:
+                    if (class_defn is recording[0].class_defn and
+                        method_name == recording[0].method_name):
+                        self.finish_trace(recording)
+                        recording = None
+                        continue
+                    if len(recording) >= MAX_TRACE_LENGTH:
+                        self.abandoned.add((recording[0].class_defn,
+                                            recording[0].method_name))
+                        recording = None
+                    else:
+                        recording.append(self.record_step(
+                            class_defn, method_name, method, length))
+                else:
+                    count = hits.get(method, 0) + 1
+                    hits[method] = count
+                    if (count % HOT == 0 and
+                        self.start_trace(class_defn, method_name)):
+                        recording = [self.record_step(
+                            class_defn, method_name, method, length)]
+                steps += length
+                next_ = method(instance)
+                if next_ is None:
+                    break
+                (instance, method_name) = next_
+            else:
+                interpreter.suspended = (instance, method_name)
+        finally:
+            interpreter.continuations += steps
+            interpreter.elapsed += clock() - start
+        return interpreter.result
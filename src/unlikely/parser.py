@@ -32,73 +32,196 @@ Constant    ::= <<sequence of decimal digits>>
 
 class Parser(object):
     """A recursive-descent parser for Unlikely.
+
+    Each production of the grammar is parsed by a method of this class,
+    which adds what it parses to the AST node it is given, through that
+    node's factory methods.  No other objects are made along the way, so
+    a single Parser can parse a whole ClassBase.  (The subclasses below
+    each parse a single production, for those who need only that.)
     """
 
-    def __init__(self, scanner):
+    def __init__(self, scanner, typecheck=True):
         """
         Creates a new Parser object.  The passed-in scanner is expected
-        to be compatible with a Scanner object.
+        to be compatible with a Scanner object.  Unless typecheck is
+        False, each class, construction and continue is typechecked as
+        soon as it has been parsed; otherwise that is left for a later
+        pass over the whole ClassBase (see checker.py.)
         """
         self.scanner = scanner
+        self.typecheck = typecheck
 
     def parse(self):
         raise NotImplementedError
 
-
-class ClassBaseParser(Parser):
     # ClassBase ::= {ClassDefn}.
 
-    def __init__(self, scanner, classbase=None):
-        Parser.__init__(self, scanner)
+    def parse_class_base(self, classbase):
+        scanner = self.scanner
+        parse_class_defn = self.parse_class_defn
+        while scanner.token == "class":
+            parse_class_defn(classbase)
+
+    def parse_class_defn(self, classbase):
+        scanner = self.scanner
+        expect = scanner.expect
+        grab = scanner.grab
+        expect("class")
+        class_name = grab()
+        class_defn = classbase.add_class_defn_by_name(class_name)
+        expect("(")
+        dependant_names = []
+        if scanner.token != ")":
+            dependant_names.append(grab())
+            while scanner.token == ",":
+                expect(",")
+                dependant_names.append(grab())
+        expect(")")
+        expect("extends")
+        class_defn.set_superclass_by_name(grab())
+        for dependant_name in dependant_names:
+            class_defn.add_dependant_by_name(dependant_name)
+        if scanner.token == "{":
+            expect("{")
+            while scanner.token != "}":
+                if scanner.token == "method":
+                    self.parse_method_defn(class_defn)
+                else:
+                    self.parse_prop_defn(class_defn)
+            expect("}")
+            is_forward_decl = False
+        else:
+            is_forward_decl = True
+        if scanner.token == "is":
+            expect("is")
+            class_defn.add_modifier(grab())
+            while scanner.token == "and":
+                expect("and")
+                class_defn.add_modifier(grab())
+        if not is_forward_decl:
+            class_defn.defined = True
+            if self.typecheck:
+                class_defn.typecheck()
+
+    def parse_prop_defn(self, class_defn):
+        scanner = self.scanner
+        class_name = scanner.grab()
+        prop_name = scanner.grab()
+        class_defn.add_prop_defn_by_name(prop_name, class_name)
+        scanner.expect(";")
+
+    def parse_method_defn(self, class_defn):
+        scanner = self.scanner
+        expect = scanner.expect
+        expect("method")
+        method_name = scanner.grab()
+        method_defn = class_defn.add_method_defn_by_name(method_name)
+        expect("(")
+        if scanner.token != ")":
+            self.parse_param_decl(method_defn)
+            while scanner.token == ",":
+                self.parse_param_decl(method_defn)
+        expect(")")
+        if scanner.token == "{":
+            expect("{")
+            parse_assignment = self.parse_assignment
+            while scanner.token != "goto":
+                parse_assignment(method_defn)
+            self.parse_continue(method_defn)
+            expect("}")
+        elif scanner.token == "is":
+            expect("is")
+            method_defn.add_modifier(scanner.grab())
+            while scanner.token == "and":
+                expect("and")
+                method_defn.add_modifier(scanner.grab())
+        else:
+            scanner.error("expected '{' or 'is', but found " +
+                          scanner.token)
+        method_defn.seal()
+
+    def parse_param_decl(self, method_defn):
+        scanner = self.scanner
+        type_class_name = scanner.grab()
+        prop_name = scanner.grab()
+        method_defn.add_param_decl_by_name(prop_name, type_class_name)
+
+    def parse_assignment(self, method_defn):
+        assignment = method_defn.add_assignment()
+        self.parse_qual_name(assignment)
+        self.scanner.expect("=")
+        self.parse_expr(assignment)
+        self.scanner.expect(";")
+
+    def parse_continue(self, method_defn):
+        scanner = self.scanner
+        expect = scanner.expect
+        continue_ = method_defn.add_continue()
+        expect("goto")
+        prop_name = scanner.grab()
+        expect(".")
+        method_name = scanner.grab()
+        continue_.set_prop_defn_by_name(prop_name)
+        continue_.set_method_defn_by_name(method_name)
+        expect("(")
+        if scanner.token != ")":
+            self.parse_expr(continue_)
+            while scanner.token == ",":
+                expect(",")
+                self.parse_expr(continue_)
+        expect(")")
+        expect(";")
+        if self.typecheck:
+            continue_.typecheck()
+        return continue_
+
+    def parse_expr(self, parent):
+        if self.scanner.token == "new":
+            self.parse_construction(parent)
+        else:
+            self.parse_qual_name(parent)
+
+    def parse_construction(self, parent):
+        scanner = self.scanner
+        expect = scanner.expect
+        expect("new")
+        class_name = scanner.grab()
+        construction = parent.add_construction(class_name)
+        expect("(")
+        if scanner.token != ")":
+            construction.add_dependency_by_name(scanner.grab())
+            while scanner.token == ",":
+                expect(",")
+                construction.add_dependency_by_name(scanner.grab())
+        expect(")")
+        if self.typecheck:
+            construction.typecheck()
+
+    def parse_qual_name(self, parent):
+        scanner = self.scanner
+        qual_name = parent.add_qual_name()
+        qual_name.add_prop_defn_by_name(scanner.grab())
+        while scanner.token == ".":
+            scanner.expect(".")
+            qual_name.add_prop_defn_by_name(scanner.grab())
+
+
+class ClassBaseParser(Parser):
+    def __init__(self, scanner, classbase=None, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.classbase = classbase
 
     def parse(self):
-        class_defn_parser = ClassDefnParser(self.scanner, self.classbase)
-        while self.scanner.token == "class":
-            class_defn_parser.parse()
+        self.parse_class_base(self.classbase)
 
 
 class ClassDefnParser(Parser):
-    def __init__(self, scanner, classbase):
-        Parser.__init__(self, scanner)
+    def __init__(self, scanner, classbase, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.classbase = classbase
 
     def parse(self):
-        self.scanner.expect("class")
-        class_name = self.scanner.grab()
-        class_defn = self.classbase.add_class_defn_by_name(class_name)
-        self.scanner.expect("(")
-        dependant_names = []
-        if self.scanner.token != ")":
-            dependant_names.append(self.scanner.grab())
-            while self.scanner.token == ",":
-                self.scanner.expect(",")
-                dependant_names.append(self.scanner.grab())
-        self.scanner.expect(")")
-        self.scanner.expect("extends")
-        class_defn.set_superclass_by_name(self.scanner.grab())
-        for dependant_name in dependant_names:
-            class_defn.add_dependant_by_name(dependant_name)
-        if self.scanner.token == "{":
-            self.scanner.expect("{")
-            while self.scanner.token != "}":
-                if self.scanner.token == "method":
-                    parser = MethodDefnParser(self.scanner, class_defn)
-                else:
-                    parser = PropDefnParser(self.scanner, class_defn)
-                parser.parse()
-            self.scanner.expect("}")
-            is_forward_decl = False
-        else:
-            is_forward_decl = True
-        if self.scanner.token == "is":
-            self.scanner.expect("is")
-            class_defn.add_modifier(self.scanner.grab())
-            while self.scanner.token == "and":
-                self.scanner.expect("and")
-                class_defn.add_modifier(self.scanner.grab())
-        if not is_forward_decl:
-            class_defn.typecheck()
+        self.parse_class_defn(self.classbase)
 
 
 class PropDefnParser(Parser):
@@ -107,45 +230,16 @@ class PropDefnParser(Parser):
         self.class_defn = class_defn
 
     def parse(self):
-        class_name = self.scanner.grab()
-        prop_name = self.scanner.grab()
-        self.class_defn.add_prop_defn_by_name(prop_name, class_name)
-        self.scanner.expect(";")
+        self.parse_prop_defn(self.class_defn)
 
 
 class MethodDefnParser(Parser):
-    def __init__(self, scanner, class_defn):
-        Parser.__init__(self, scanner)
+    def __init__(self, scanner, class_defn, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.class_defn = class_defn
 
     def parse(self):
-        self.scanner.expect("method")
-        method_name = self.scanner.grab()
-        method_defn = self.class_defn.add_method_defn_by_name(method_name)
-        self.scanner.expect("(")
-        if self.scanner.token != ")":
-            param_decl_parser = ParamDeclParser(self.scanner, method_defn)
-            param_decl_parser.parse()
-            while self.scanner.token == ",":
-                param_decl_parser.parse()
-        self.scanner.expect(")")
-        if self.scanner.token == "{":
-            self.scanner.expect("{")
-            assignment_parser = AssignmentParser(self.scanner, method_defn)
-            while self.scanner.token != "goto":
-                assignment_parser.parse()
-            continue_parser = ContinueParser(self.scanner, method_defn)
-            continue_parser.parse()
-            self.scanner.expect("}")
-        elif self.scanner.token == "is":
-            self.scanner.expect("is")
-            method_defn.add_modifier(self.scanner.grab())
-            while self.scanner.token == "and":
-                self.scanner.expect("and")
-                method_defn.add_modifier(self.scanner.grab())
-        else:
-            self.scanner.error("expected '{' or 'is', but found " +
-                               self.scanner.token)
+        self.parse_method_defn(self.class_defn)
 
 
 class ParamDeclParser(Parser):
@@ -154,82 +248,43 @@ class ParamDeclParser(Parser):
         self.method_defn = method_defn
 
     def parse(self):
-        type_class_name = self.scanner.grab()
-        prop_name = self.scanner.grab()
-        self.method_defn.add_param_decl_by_name(prop_name, type_class_name)
+        self.parse_param_decl(self.method_defn)
 
 
 class AssignmentParser(Parser):
-    def __init__(self, scanner, method_defn):
-        Parser.__init__(self, scanner)
+    def __init__(self, scanner, method_defn, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.method_defn = method_defn
 
     def parse(self):
-        assignment = self.method_defn.add_assignment()
-        qual_name_parser = QualNameParser(self.scanner, assignment)
-        qual_name_parser.parse()
-        self.scanner.expect("=")
-        expr_parser = ExprParser(self.scanner, assignment)
-        expr_parser.parse()
-        self.scanner.expect(";")
+        self.parse_assignment(self.method_defn)
 
 
 class ContinueParser(Parser):
-    def __init__(self, scanner, method_defn):
-        Parser.__init__(self, scanner)
+    def __init__(self, scanner, method_defn, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.method_defn = method_defn
 
     def parse(self):
-        continue_ = self.method_defn.add_continue()
-        self.scanner.expect("goto")
-        prop_name = self.scanner.grab()
-        self.scanner.expect(".")
-        method_name = self.scanner.grab()
-        continue_.set_prop_defn_by_name(prop_name)
-        continue_.set_method_defn_by_name(method_name)
-        self.scanner.expect("(")
-        expr_parser = ExprParser(self.scanner, continue_)
-        if self.scanner.token != ")":
-            expr_parser.parse()
-            while self.scanner.token == ",":
-                self.scanner.expect(",")
-                expr_parser.parse()
-        self.scanner.expect(")")
-        self.scanner.expect(";")
-        continue_.typecheck()
-        return continue_
+        return self.parse_continue(self.method_defn)
 
 
 class ExprParser(Parser):
-    def __init__(self, scanner, parent):
-        Parser.__init__(self, scanner)
+    def __init__(self, scanner, parent, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.parent = parent
 
     def parse(self):
-        if self.scanner.token == "new":
-            parser = ConstructionParser(self.scanner, self.parent)
-        else:
-            parser = QualNameParser(self.scanner, self.parent)
-        parser.parse()
+        self.parse_expr(self.parent)
 
 
 class ConstructionParser(Parser):
-    def __init__(self, scanner, parent):
-        Parser.__init__(self, scanner)
+    def __init__(self, scanner, parent, typecheck=True):
+        Parser.__init__(self, scanner, typecheck)
         self.parent = parent
 
     def parse(self):
-        self.scanner.expect("new")
-        class_name = self.scanner.grab()
-        construction = self.parent.add_construction(class_name)
-        self.scanner.expect("(")
-        if self.scanner.token != ")":
-            construction.add_dependency_by_name(self.scanner.grab())
-            while self.scanner.token == ",":
-                self.scanner.expect(",")
-                construction.add_dependency_by_name(self.scanner.grab())
-        self.scanner.expect(")")
-        construction.typecheck()
+        self.parse_construction(self.parent)
 
 
 class QualNameParser(Parser):
@@ -238,8 +293,4 @@ class QualNameParser(Parser):
         self.parent = parent
 
     def parse(self):
-        qual_name = self.parent.add_qual_name()
-        qual_name.add_prop_defn_by_name(self.scanner.grab())
-        while self.scanner.token == ".":
-            self.scanner.expect(".")
-            qual_name.add_prop_defn_by_name(self.scanner.grab())
+        self.parse_qual_name(self.parent)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Runtime profile of Unlikely programs.
+
+A Profile counts the continuations of each method of each class, and the
+constructions of each class, and times the built-in methods and
+intrinsics.  It is given to an Interpreter when it is created, and the
+Interpreter and its Compiler then wrap the closures they build with
+counting (or timing) ones, so a program run without a Profile runs the
+same closures it always did, and pays nothing for it.
+
+A fused chain (see fusion.py) counts as a continuation of each of its
+links, and a construction of each of them too (though none is actually
+constructed.)
+"""
+
+import time
+
+
+clock = getattr(time, "perf_counter", time.time)
+
+
+class Profile(object):
+    """
+    Counts and times what an Unlikely program does while it runs.  Each
+    count is kept in a one-element list, which the counting closures
+    increment directly.
+    """
+
+    def __init__(self):
+        self.continuations = {}
+        self.constructions = {}
+        self.natives = {}
+
+    def counter(self, table, key):
+        if key not in table:
+            table[key] = [0]
+        return table[key]
+
+    def count_method(self, class_defn, method_name, method, fused):
+        """Returns a closure which counts a continuation of the named
+        method on an instance of the given class, and then runs the given
+        closure.  If it is a fused chain (that is, in fused), so is the
+        closure returned, and the one the trampoline falls back to is
+        counted too.
+
+        """
+        count = self.counter(self.continuations,
+                             (class_defn.name, method_name))
+
+        def count_calls(method):
+            def counted(instance):
+                count[0] += 1
+                return method(instance)
+            return counted
+        if method not in fused:
+            return count_calls(method)
+        (length, plain, guard, links) = fused[method]
+        counts = [self.counter(self.continuations, (link.name, "continue"))
+                  for link in links]
+        counts.extend([self.counter(self.constructions, link.name)
+                       for link in links])
+
+        def counted_fused(instance):
+            count[0] += 1
+            for link_count in counts:
+                link_count[0] += 1
+            return method(instance)
+        fused[counted_fused] = (length, count_calls(plain), guard, links)
+        return counted_fused
+
+    def count_construction(self, class_defn, construct):
+        """Returns a closure which runs the given construction, of the
+        given class (or of one injected in place of it), and counts what
+        it constructed.
+
+        """
+        count = self.counter(self.constructions, class_defn.name)
+        constructions = self.constructions
+
+        def counted(instance):
+            result = construct(instance)
+            name = getattr(result, "class_defn", class_defn).name
+            if name == class_defn.name:
+                count[0] += 1
+            else:
+                self.counter(constructions, name)[0] += 1
+            return result
+        return counted
+
+    def time_native(self, name, native):
+        """Returns a function which times calls of the given built-in method
+        or intrinsic, under the given name.
+
+        """
+        cell = self.natives.setdefault(name, [0, 0.0])
+
+        def timed(*args):
+            start = clock()
+            try:
+                return native(*args)
+            finally:
+                cell[0] += 1
+                cell[1] += clock() - start
+        return timed
+
+    def dump(self, stream):
+        """Writes the profile to the given stream, the most frequent (or
+        the slowest) first, leaving out the built-ins that never ran.
+
+        """
+        def ranked(table):
+            return sorted(table.items(), key=lambda item: (-item[1][0],
+                                                           item[0]))
+        stream.write("continuations:\n")
+        for ((class_name, method_name), count) in \
+          ranked(self.continuations):
+            stream.write("%12d  %s.%s\n" % (count[0], class_name,
+                                            method_name))
+        stream.write("constructions:\n")
+        for (class_name, count) in ranked(self.constructions):
+            stream.write("%12d  %s\n" % (count[0], class_name))
+        stream.write("natives:\n")
+        for (name, (calls, elapsed)) in \
+          sorted(self.natives.items(), key=lambda item: (-item[1][1],
+                                                         item[0])):
+            if calls > 0:
+                stream.write("%12d  %.6fs  %s\n" % (calls, elapsed,
+                                                     name))
+        stream.flush()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Runtime representation of Unlikely objects.
+
+Passive values (integers, strings and booleans) are normally not
+represented by Instances at all, but by the Python values themselves,
+wherever they are stored: in the accumulator, or in any other property.
+Only when a property of a passive value is assigned (its next, say) is it
+boxed into an Instance, in place, by container_at.
+"""
+
+import numbers
+
+from .ast import ValueClassDefn
+from . import stdlib
+
+
+class UnassignedPropertyError(Exception):
+    """An exception indicating that a property was read before any value
+    was assigned to it.
+
+    """
+    pass
+
+
+class AbstractMethodError(Exception):
+    """An exception indicating that a method with no implementation was
+    continued.
+
+    """
+    pass
+
+
+def unassigned(instance, index):
+    if not isinstance(instance, Instance):
+        instance = box(instance)
+    prop_defn = instance.class_defn.get_slot_layout()[index]
+    return UnassignedPropertyError(instance.class_defn.name + "." +
+                                   prop_defn.name)
+
+
+# The injections of an instance whose class has no dependant classes (or
+# which was not given any), shared by all of them.
+NO_INJECTIONS = {}
+
+
+class Instance(object):
+    """
+    Represents an instance of an Unlikely class, at runtime.
+
+    injections maps the names of the class's dependant classes to the
+    classes that were injected for them when the instance was created.
+    It may be shared with other instances, and must not be modified.
+    Instances of the passive value classes carry their Python value.
+
+    Property values are kept in the slots list, at the indices given by
+    the slot layout of the class; None marks a property that has not been
+    assigned yet.
+    """
+
+    __slots__ = ('class_defn', 'injections', 'slots', 'value')
+
+    def __init__(self, class_defn, injections=None, value=None):
+        self.class_defn = class_defn
+        if injections is None:
+            injections = NO_INJECTIONS
+        self.injections = injections
+        self.slots = [None] * len(class_defn.get_slot_layout())
+        self.value = value
+
+    def __str__(self):
+        if self.value is None:
+            return self.class_defn.name
+        return str(self.value)
+
+    def set(self, prop_name, value):
+        prop_defn = self.class_defn.lookup_prop_defn(prop_name)
+        self.slots[prop_defn.get_slot_index()] = value
+
+    def get(self, prop_name):
+        prop_defn = self.class_defn.lookup_prop_defn(prop_name)
+        return self.get_slot(prop_defn.get_slot_index())
+
+    def get_slot(self, index):
+        value = self.slots[index]
+        if value is None:
+            raise unassigned(self, index)
+        return value
+
+    def resolve_class_defn(self, class_defn):
+        """Returns the class that was injected for the given dependant class
+        of this instance's class, or the class itself if it is final.
+
+        """
+        return self.injections.get(class_defn.name, class_defn)
+
+
+def value_of_class_defn(class_defn):
+    """Returns the Python value represented by one of the passive value
+    classes (3, "foo", True, ...), or None if it is not one of those.
+
+    """
+    if isinstance(class_defn, ValueClassDefn):
+        return class_defn.value
+    if class_defn is stdlib.true_:
+        return True
+    if class_defn is stdlib.false_:
+        return False
+    return None
+
+
+def box(value):
+    """Returns an instance of a passive value class carrying the given
+    Python value.  Integers and strings are boxed as instances of Integer
+    and String themselves, since only the value matters at runtime.
+
+    """
+    if value is True:
+        return Instance(stdlib.true_, value=True)
+    if value is False:
+        return Instance(stdlib.false_, value=False)
+    if isinstance(value, numbers.Integral):
+        return Instance(stdlib.integer_, value=value)
+    return Instance(stdlib.string_, value=value)
+
+
+def unbox(value):
+    """Returns the Python value of a passive value, boxed or not."""
+    if type(value) is Instance:
+        return value.value
+    return value
+
+
+def container_at(instance, index):
+    """Returns the object stored in the given slot of the given instance,
+    so that its properties can be assigned.  A passive value stored there
+    is boxed, and the box stored back in its place.
+
+    """
+    value = instance.slots[index]
+    if type(value) is not Instance:
+        if value is None:
+            raise unassigned(instance, index)
+        value = box(value)
+        instance.slots[index] = value
+    return value
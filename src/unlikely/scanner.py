@@ -7,60 +7,121 @@
 Lexical scanner for the Unlikely programming language.
 """
 
+import codecs
+import re
+
+
+# Whitespace and (* comments *), skipped as a single run.  An unterminated
+# comment extends to the end of the input.
+SKIP = re.compile(r'(?:\s+|\(\*.*?(?:\*\)|\Z))*', re.DOTALL | re.UNICODE)
+
+# One token.  Identifiers start with an alphabetic character and continue
+# with alphanumerics; string literals run to the next double quote (or to
+# the end of the input, if there isn't one.)
+TOKEN = re.compile(r'''
+    (?P<ident>[^\W\d_][^\W_]*)
+  | (?P<int>\d+)
+  | (?P<string>"[^"]*"?)
+  | (?P<op>.)
+''', re.VERBOSE | re.DOTALL | re.UNICODE)
+
+
+def make_token(match):
+    """
+    Return the (token, toktype, tokval) triple for the given match of
+    TOKEN.  An unterminated string literal is terminated.
+    """
+    toktype = match.lastgroup
+    token = match.group()
+    tokval = None
+    if toktype == "int":
+        tokval = int(token)
+    elif toktype == "string":
+        if len(token) < 2 or token[-1] != "\"":
+            token = token + "\""
+        tokval = token[1:-1]
+    return (token, toktype, tokval)
+
 
 class Scanner(object):
     """
     A lexical scanner.
     """
 
-    def __init__(self, input_):
+    def __init__(self, input_, chunk_size=65536):
         """
         Create a new Scanner object that will consume the given
         UTF-8 encoded input string.
+
+        The input may also be a file object or an mmap (anything with a
+        read() method), in which case it is read and decoded incrementally,
+        chunk_size bytes at a time, as tokens are demanded.
         """
-        self._input = input_.decode('utf-8')
+        if hasattr(input_, 'read'):
+            self._stream = input_
+            self._decoder = codecs.getincrementaldecoder('utf-8')()
+            self._input = u""
+        else:
+            self._stream = None
+            self._input = input_.decode('utf-8')
+        self._chunk_size = chunk_size
+        self._pos = 0
+        self.errors = 0
         self._token = None
+        self.toktype = None
+        self.tokval = None
         self.scan()
 
+    def _fill(self, size):
+        """
+        Read and decode (at least) size more bytes of a streaming input,
+        discarding the part of the buffer that has already been scanned.
+        Returns False if there was nothing more to read.
+        """
+        if self._stream is None:
+            return False
+        data = self._stream.read(size)
+        if data:
+            text = self._decoder.decode(data)
+        else:
+            text = self._decoder.decode(b"", True)
+            self._stream = None
+        self._input = self._input[self._pos:] + text
+        self._pos = 0
+        return True
+
     def scan(self):
         """
         Consume a token from the input.
+
+        When streaming, a match that runs into the end of the buffer may
+        be cut short by the chunk boundary (an identifier, number, string
+        literal or comment continuing into the next chunk, or a "(" that is
+        the start of a comment), so more input is read and the match is
+        retried.
         """
-        self._token = ""
-        while self._input[0].isspace():
-            self._input = self._input[1:]
-            if len(self._input) == 0:
+        size = self._chunk_size
+        while True:
+            input_ = self._input
+            end = len(input_)
+            pos = SKIP.match(input_, self._pos).end()
+            if pos >= end:
+                if self._fill(size):
+                    size *= 2
+                    continue
+                self._pos = pos
+                self._token = ""
+                self.toktype = "eof"
                 return
-        if self._input[0].isalpha():
-            while self._input[0].isalnum():
-                self._token += self._input[0]
-                self._input = self._input[1:]
-            self.toktype = "ident"
-        elif self._input[0].isdigit():
-            while self._input[0].isdigit():
-                self._token += self._input[0]
-                self._input = self._input[1:]
-            self.toktype = "int"
-            self.tokval = int(self._token)
-        elif self._input[:1] == "\"":
-            st = ""
-            self._input = self._input[1:]
-            while self._input[:1] != "\"":
-                st += self._input[:1]
-                self._input = self._input[1:]
-            self._input = self._input[1:]
-            self.toktype = "string"
-            self.tokval = st
-            self._token = "\"" + st + "\""
-        elif self._input[:2] == '(*':
-            while self._input[:2] != '*)':
-                self._input = self._input[1:]
-            self._input = self._input[2:]
-            return self.scan()
-        else:
-            self._token = self._input[0]
-            self._input = self._input[1:]
-            self.toktype = "op"
+            match = TOKEN.match(input_, pos)
+            if match.end() >= end and self._stream is not None:
+                # also rescan whatever whitespace preceded the token
+                self._fill(size)
+                size *= 2
+                continue
+            break
+        self._pos = match.end()
+        (self._token, self.toktype, self.tokval) = make_token(match)
 
     def get_token(self):
         return self._token
@@ -89,5 +150,55 @@ class Scanner(object):
         """
         Log the given scan error.
         """
+        self.errors += 1
         print("error: " + str)
         self.scan()
+
+
+def scan_tokens(input_):
+    """
+    Scan the whole of the given input (anything a Scanner accepts), and
+    return its tokens, just as a Scanner would have scanned them, as a
+    list of (token, toktype, tokval) triples.
+    """
+    if hasattr(input_, 'read'):
+        input_ = input_.read()
+    input_ = input_.decode('utf-8')
+    end = len(input_)
+    skip = SKIP.match
+    match_token = TOKEN.match
+    tokens = []
+    pos = skip(input_, 0).end()
+    while pos < end:
+        match = match_token(input_, pos)
+        tokens.append(make_token(match))
+        pos = skip(input_, match.end()).end()
+    return tokens
+
+
+class TokenScanner(Scanner):
+    """
+    A scanner which replays a list of tokens, as returned by scan_tokens,
+    instead of scanning any input.  position is the index of the current
+    token in the list (or its length, at the end.)
+    """
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self.position = -1
+        self.errors = 0
+        self.scan()
+
+    def scan(self):
+        """
+        Consume a token from the list.
+        """
+        if self.position < len(self._tokens):
+            self.position += 1
+        if self.position < len(self._tokens):
+            (self._token, self.toktype, self.tokval) = \
+              self._tokens[self.position]
+        else:
+            self._token = ""
+            self.toktype = "eof"
+            self.tokval = None
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Running many Unlikely programs together, in one process.
+
+Since no Unlikely method ever returns, a program can be stopped between
+any two continuations, and resumed from the one it stopped at later (see
+interpreter.py.)  The Scheduler takes advantage of this to run many
+programs as Tasks, interleaving them: each in turn is run for a slice of
+so many continuations (more for a Task with more weight), and then put at
+the back of the queue.  Between slices, each Task is held to its quotas:
+the continuations it may run in all, and the objects it may keep alive,
+counted from the continuation it stopped at.
+
+Tasks may share an Interpreter, and with it the methods it has compiled,
+and what the programs print, so long as none of them reads input.  A
+program which does should have an Interpreter of its own, created with
+suspend_input, so that it waits, without holding up the others, until it
+is given a line of input.
+"""
+
+from collections import deque
+
+from .runtime import Instance
+
+
+# How many continuations a Task of weight 1 is run for at a time.
+SLICE = 1000
+
+
+class QuotaExceededError(Exception):
+    """
+    Recorded as the error of a Task which has run more continuations, or
+    kept more objects alive, than its quota allows.
+    """
+    pass
+
+
+def count_instances(instance, limit=None):
+    """Returns the number of objects reachable from the given one, or
+    limit + 1 if there are more than limit of them.  (Passive values
+    which were never boxed are not counted.)
+
+    """
+    seen = set()
+    pending = [instance]
+    while pending:
+        instance = pending.pop()
+        if type(instance) is not Instance or id(instance) in seen:
+            continue
+        seen.add(id(instance))
+        if limit is not None and len(seen) > limit:
+            break
+        pending.extend(instance.slots)
+    return len(seen)
+
+
+class Task(object):
+    """
+    A program being run by a Scheduler.  Once it is done, it has either a
+    result (the value it passed to Stop) or an error (what it raised, or
+    the QuotaExceededError it was stopped with.)  Until then, the
+    continuation it is to resume from is kept in suspended, rather than in
+    its interpreter, which other Tasks may be using.
+    """
+
+    def __init__(self, interpreter, class_defn, accumulator=None, weight=1,
+                 max_steps=None, max_instances=None, name=None):
+        self.interpreter = interpreter
+        self.weight = weight
+        self.max_steps = max_steps
+        self.max_instances = max_instances
+        self.name = name or class_defn.name
+        self.steps = 0
+        self.slices = 0
+        self.done = False
+        self.result = None
+        self.error = None
+        interpreter.start(class_defn, accumulator)
+        self.suspended = interpreter.suspended
+        interpreter.suspended = None
+
+    def __str__(self):
+        if not self.done:
+            return "%s: running (%d continuations)" % (self.name, self.steps)
+        if self.error is not None:
+            return "%s: %s: %s" % (self.name, self.error.__class__.__name__,
+                                   self.error)
+        return "%s: stopped with %s (%d continuations)" % \
+               (self.name, self.result, self.steps)
+
+    def waiting(self):
+        """Returns True if the program is waiting for a line of input."""
+        return (not self.done and self.interpreter.waiting and
+                not self.interpreter.lines)
+
+    def give_input(self, line):
+        """Gives the program a line of input, for the next Input it
+        continues to read.
+
+        """
+        self.interpreter.lines.append(line)
+
+    def run(self, slice_steps):
+        """Runs the program for at most slice_steps continuations (or for
+        one more than its quota has left, if that is fewer, so that it can
+        be seen to overrun it), and then holds it to its quotas.  Returns
+        True if it is done.
+
+        """
+        limit = slice_steps
+        if self.max_steps is not None:
+            limit = min(limit, self.max_steps - self.steps + 1)
+        interpreter = self.interpreter
+        interpreter.suspended = self.suspended
+        self.suspended = None
+        start = interpreter.continuations
+        try:
+            try:
+                self.result = interpreter.resume(limit)
+            finally:
+                self.steps += interpreter.continuations - start
+                self.slices += 1
+                self.suspended = interpreter.suspended
+                interpreter.suspended = None
+        except Exception as e:
+            self.finish(error=e)
+            return True
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.finish(error=QuotaExceededError(
+                "ran more than %d continuations" % self.max_steps))
+        elif self.suspended is None:
+            self.finish()
+        elif (self.max_instances is not None and
+              count_instances(self.suspended[0], self.max_instances) >
+              self.max_instances):
+            self.finish(error=QuotaExceededError(
+                "kept more than %d objects alive" % self.max_instances))
+        return self.done
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        if error is not None:
+            self.result = None
+        self.suspended = None
+        self.interpreter.stdout.flush()
+
+
+class Scheduler(object):
+    """
+    Runs Tasks in turn, round robin, each for slice_steps continuations
+    times its weight at a time, until they are all done or waiting for
+    input.
+    """
+
+    def __init__(self, slice_steps=SLICE):
+        self.slice_steps = slice_steps
+        self.queue = deque()
+        self.waiting = []
+        self.tasks = []
+
+    def spawn(self, interpreter, class_defn, **kwargs):
+        """Creates a Task running the given Program class with the given
+        Interpreter (the other arguments are as for Task), adds it to the
+        back of the queue, and returns it.
+
+        """
+        task = Task(interpreter, class_defn, **kwargs)
+        self.tasks.append(task)
+        self.queue.append(task)
+        return task
+
+    def give_input(self, task, line):
+        """Gives the given Task a line of input, and if it was waiting for
+        one, puts it back at the back of the queue.
+
+        """
+        task.give_input(line)
+        if task in self.waiting:
+            self.waiting.remove(task)
+            self.queue.append(task)
+
+    def step(self):
+        """Runs the Task at the front of the queue for one slice.  Returns
+        the Task, or None if there is none to run.
+
+        """
+        if not self.queue:
+            return None
+        task = self.queue.popleft()
+        if not task.run(self.slice_steps * task.weight):
+            if task.waiting():
+                self.waiting.append(task)
+            else:
+                self.queue.append(task)
+        return task
+
+    def run(self):
+        """Runs the Tasks until every one of them is done, or waiting for
+        input.  Returns the Tasks, in the order they were spawned.
+
+        """
+        while self.step() is not None:
+            pass
+        return self.tasks
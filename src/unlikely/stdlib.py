@@ -87,3 +87,7 @@ for_loop = stdlib.add_class_defn_by_name("ForLoop", "Loop")
 for_loop.add_prop_defn_by_name("value", "Integer")
 for_loop.add_prop_defn_by_name("delta", "Integer")
 for_loop.add_prop_defn_by_name("finish", "Integer")
+
+# The stdlib is shared by every program checked in this process, each of
+# which adds its classes to its own overlay (ClassBase(stdlib)) instead.
+stdlib.freeze()
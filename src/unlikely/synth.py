@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# (c)2010-2012 Chris Pressey, Cat's Eye Technologies.
+# All rights reserved.  Released under a BSD-style license (see LICENSE).
+
+"""
+Generator of synthetic Unlikely programs, for benchmarking.
+
+A generated program is a ring of final classes, each of which prints the
+accumulator, adds a constant to it, and continues the next class in the
+ring (so the program runs until it is stopped after some number of
+continuations.)  Each class in the ring extends the last of a chain of
+abstract layer classes, each of which declares a property, and also
+declares properties of some further dependant classes from the stdlib.
+Its method constructs one object of each of those dependants and makes
+some further assignments to the properties declared by it and its layers,
+of constants from a pool of literals, or of the accumulator if the pool is
+empty.
+"""
+
+import random
+
+
+# Non-final stdlib classes which a Chain can be constructed from.
+DEPENDANT_POOL = ["Subtract", "Multiply", "Divide", "Equal", "GreaterThan",
+                  "Input", "If", "WhileLoop", "ForLoop"]
+
+# Words which comments are made of.
+WORDS = ["continue", "the", "accumulator", "next", "class", "inject",
+         "print", "add", "a", "value", "to", "of"]
+
+
+def literal_pool(literals):
+    """Returns the given number of distinct literals, integers and strings
+    alternately.
+
+    """
+    pool = []
+    for index in range(literals):
+        if index % 2 == 0:
+            pool.append(str(index // 2 + 2))
+        else:
+            pool.append('"s%d"' % (index // 2))
+    return pool
+
+
+class Synthesizer(object):
+    """
+    Generates an Unlikely program along the given axes: the number of
+    classes in the ring, the depth of the chain of layers beneath them, the
+    number of further dependants of each, the number of further assignments
+    in each method, the number of distinct literals used in them, and the
+    chance of a comment before each line of code (from 0.0 to 1.0.)
+    """
+
+    def __init__(self, classes=10, depth=1, dependants=2, assignments=4,
+                 literals=8, comments=0.1, seed=0):
+        if classes < 1:
+            raise ValueError("there must be at least 1 class")
+        if depth < 0 or assignments < 0 or literals < 0:
+            raise ValueError("depth, assignments and literals cannot be "
+                             "negative")
+        if dependants < 0 or dependants > len(DEPENDANT_POOL):
+            raise ValueError("there can be from 0 to %d dependants" %
+                             len(DEPENDANT_POOL))
+        if comments < 0.0 or comments > 1.0:
+            raise ValueError("comments must be from 0.0 to 1.0")
+        self.classes = classes
+        self.depth = depth
+        self.dependants = dependants
+        self.assignments = assignments
+        self.literals = literals
+        self.comments = comments
+        self.random = random.Random(seed)
+        self.lines = []
+
+    def comment(self):
+        words = [self.random.choice(WORDS)
+                 for index in range(self.random.randint(2, 8))]
+        return "(* " + " ".join(words) + " *)"
+
+    def emit(self, line):
+        if self.comments > 0.0 and self.random.random() < self.comments:
+            indent = line[:len(line) - len(line.lstrip())]
+            self.lines.append(indent + self.comment())
+        self.lines.append(line)
+
+    def ring_class_name(self, index):
+        return "R%d" % (index % self.classes)
+
+    def generate(self):
+        """Returns the source of the program, as a string."""
+        self.lines = []
+        extras = DEPENDANT_POOL[:self.dependants]
+        dependant_names = ["Chain", "Print", "Add"] + extras
+        injections = ",".join(["Passive"] + dependant_names)
+        superclass_name = "Continuation"
+        if self.depth > 0:
+            superclass_name = "L%d" % self.depth
+        for index in range(self.depth):
+            self.emit("class L%d() extends %s {" %
+                      (index + 1, "L%d" % index if index > 0
+                                  else "Continuation"))
+            self.emit("  Passive l%d;" % (index + 1))
+            self.emit("} is abstract")
+        for index in range(self.classes):
+            self.emit("class %s(%s) extends %s is final" %
+                      (self.ring_class_name(index),
+                       ",".join(dependant_names), superclass_name))
+        self.emit("class Main(%s) extends Program {" %
+                  ",".join(dependant_names))
+        self.emit("  R0 r;")
+        self.emit("  method continue(Passive accumulator) {")
+        self.emit("    r = new R0(%s);" % injections)
+        self.emit("    goto r.continue(new 0(Passive));")
+        self.emit("  }")
+        self.emit("}")
+        targets = ["x"] + ["l%d" % (index + 1)
+                           for index in range(self.depth)]
+        pool = literal_pool(self.literals)
+        literal = 0
+        for index in range(self.classes):
+            self.emit("class %s() extends %s {" %
+                      (self.ring_class_name(index), superclass_name))
+            self.emit("  %s c;" % self.ring_class_name(index + 1))
+            self.emit("  Print p;")
+            self.emit("  Add a;")
+            self.emit("  Passive x;")
+            for (number, extra) in enumerate(extras):
+                self.emit("  %s d%d;" % (extra, number))
+            self.emit("  method continue(Passive accumulator) {")
+            self.emit("    c = new %s(%s);" %
+                      (self.ring_class_name(index + 1), injections))
+            for number in range(len(extras)):
+                self.emit("    d%d = new %s(Passive,Chain);" %
+                          (number, extras[number]))
+            for number in range(self.assignments):
+                target = targets[number % len(targets)]
+                if pool:
+                    self.emit("    %s = new %s(Passive);" %
+                              (target, pool[literal % len(pool)]))
+                    literal += 1
+                else:
+                    self.emit("    %s = accumulator;" % target)
+            self.emit("    a = new Add(Passive,Chain);")
+            self.emit("    a.value = new 1(Passive);")
+            self.emit("    a.next = c;")
+            self.emit("    p = new Print(Passive,Chain);")
+            self.emit("    p.next = a;")
+            self.emit("    goto p.continue(accumulator);")
+            self.emit("  }")
+            self.emit("}")
+        return "\n".join(self.lines) + "\n"
+
+
+def generate(**axes):
+    """Returns the source of a program generated by a Synthesizer with the
+    given axes (and seed.)
+
+    """
+    return Synthesizer(**axes).generate()